@@ -0,0 +1,197 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+
+class AMRCache:
+    """
+    Disk-backed sentence -> AMR cache stored in SQLite.
+
+    Keys combine the normalized sentence with the model path and generation
+    settings, so a different checkpoint or decoding mode never reuses stale
+    results. Values are the final sanitized PENMAN strings. Once the table
+    holds more than `max_entries` rows, the least recently used ones are evicted.
+
+    Example:
+        >>> cache = AMRCache("amr_cache.sqlite", model_name="outputs/Qwen-1.7B-SFT-2", settings={"constrained": 1})
+        >>> cache.get("tôi có nhà") is None
+        True
+        >>> cache.put("tôi có nhà", "(c / có :ARG0 (t / tôi) :ARG1 (n / nhà))")
+    """
+
+    def __init__(self, path, model_name, settings=None, max_entries=100000):
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS amr_cache ("
+            "key TEXT PRIMARY KEY, sentence TEXT, amr TEXT, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS amr_cache_last_used ON amr_cache (last_used)")
+        self.conn.commit()
+        self.namespace = json.dumps({"model": model_name, **(settings or {})}, sort_keys=True, ensure_ascii=False)
+        self.max_entries = max_entries
+        self.size = self.conn.execute("SELECT COUNT(*) FROM amr_cache").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, sentence):
+        return hashlib.sha256(f"{self.namespace}\n{sentence}".encode("utf-8")).hexdigest()
+
+    def get(self, sentence):
+        key = self.key(sentence)
+        row = self.conn.execute("SELECT amr FROM amr_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.conn.execute("UPDATE amr_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+        self.conn.commit()
+        return row[0]
+
+    def put(self, sentence, amr):
+        key = self.key(sentence)
+        cursor = self.conn.execute(
+            "INSERT OR IGNORE INTO amr_cache (key, sentence, amr, last_used) VALUES (?, ?, ?, ?)",
+            (key, sentence, amr, time.time())
+        )
+        if cursor.rowcount == 0:
+            self.conn.execute("UPDATE amr_cache SET amr = ?, last_used = ? WHERE key = ?", (amr, time.time(), key))
+        else:
+            self.size += 1
+        if self.size > self.max_entries:
+            self.evict()
+        self.conn.commit()
+
+    def evict(self):
+        """Drop least recently used entries, leaving 10% headroom below max_entries."""
+        keep = int(self.max_entries * 0.9)
+        self.conn.execute(
+            "DELETE FROM amr_cache WHERE key IN "
+            "(SELECT key FROM amr_cache ORDER BY last_used ASC LIMIT ?)",
+            (self.size - keep,)
+        )
+        self.size = self.conn.execute("SELECT COUNT(*) FROM amr_cache").fetchone()[0]
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": self.size,
+        }
+
+    def close(self):
+        self.conn.close()
+
+
+class SmatchCache:
+    """
+    LRU cache of smatch results keyed on whitespace-normalized (gold, pred)
+    strings, optionally persisted to SQLite so later runs start warm.
+
+    Lookups hit the in-memory LRU first, then the database. Both keep at most
+    `max_entries` rows; the database evicts its oldest inserts. Each process
+    opens its own connection, so the cache can be shared by reward workers.
+    `namespace` separates results of different smatch implementations.
+    Database writes are committed (and evicted) in bulk every `commit_every`
+    puts or `commit_interval` seconds, and by `flush`.
+
+    Example:
+        >>> cache = SmatchCache(max_entries=1000)
+        >>> cache.put("(a / b)", "(a / b)", (1.0, 1.0, 1.0))
+        >>> cache.get("(a  /  b)", "(a / b)")
+        (1.0, 1.0, 1.0)
+    """
+
+    def __init__(self, max_entries=100000, path=None, namespace="", commit_every=256, commit_interval=10.0):
+        self.max_entries = max_entries
+        self.path = path
+        self.namespace = namespace
+        self.commit_every = commit_every
+        self.commit_interval = commit_interval
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._pid = None
+        self._pending = 0
+        self._last_commit = time.time()
+
+    def key(self, gold, pred):
+        normalized = " ".join(gold.split()) + "\n" + " ".join(pred.split())
+        if self.namespace:
+            normalized = self.namespace + "\n" + normalized
+        return hashlib.blake2b(normalized.encode("utf-8"), digest_size=16).hexdigest()
+
+    @property
+    def conn(self):
+        if self.path is None:
+            return None
+        if self._pid != os.getpid():
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            self._conn = sqlite3.connect(self.path, timeout=30)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # A lost tail only costs recomputation, so WAL commits need not fsync
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS smatch_cache (key TEXT PRIMARY KEY, f1 REAL, precision REAL, recall REAL)")
+            self._conn.commit()
+            self._pid = os.getpid()
+            self._pending = 0
+        return self._conn
+
+    def _remember(self, key, value):
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def get(self, gold, pred):
+        key = self.key(gold, pred)
+        value = self.entries.get(key)
+        if value is not None:
+            self.entries.move_to_end(key)
+        elif self.conn is not None:
+            row = self.conn.execute("SELECT f1, precision, recall FROM smatch_cache WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                value = tuple(row)
+                self._remember(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, gold, pred, value):
+        key = self.key(gold, pred)
+        self._remember(key, tuple(value))
+        if self.conn is not None:
+            self.conn.execute("INSERT OR REPLACE INTO smatch_cache (key, f1, precision, recall) VALUES (?, ?, ?, ?)", (key, *value))
+            self._pending += 1
+            if self._pending >= self.commit_every or time.time() - self._last_commit >= self.commit_interval:
+                self.flush()
+
+    def flush(self):
+        """Evict the oldest database rows beyond `max_entries` and commit pending writes."""
+        if self._pending and self.conn is not None:
+            self.conn.execute(
+                "DELETE FROM smatch_cache WHERE rowid <= (SELECT MAX(rowid) FROM smatch_cache) - ?",
+                (self.max_entries,)
+            )
+            self.conn.commit()
+        self._pending = 0
+        self._last_commit = time.time()
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+        }
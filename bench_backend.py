@@ -0,0 +1,70 @@
+import argparse
+import time
+
+import torch
+
+from .infer import QwenReasoner, BACKENDS
+from .main import normalize_sentence, decode_amr, finalize_amr
+from .data_processing import read_amr_direct, penman_to_one_line
+from .reward import compute_smatch_f1
+
+
+def run_backend(args, backend, sentences, golds):
+    device = args.device if backend == "hf" else "cpu"
+    model = QwenReasoner(model_name=args.model_name, device=device, backend=backend, num_threads=args.num_threads or None)
+    torch.manual_seed(args.seed)
+    start_time = time.time()
+    outputs = model.inference_batch(
+        [normalize_sentence(sentence) for sentence in sentences],
+        batch_size=args.batch_size,
+        max_new_tokens=args.max_new_tokens,
+        is_extract_amr=True,
+        is_thinking=True,
+        # Greedy, so the Smatch difference comes from the backend and not from sampling noise
+        do_sample=False
+    )
+    elapsed = time.time() - start_time
+
+    f1_scores = []
+    for (thinking, predict), gold in zip(outputs, golds):
+        amr_str = decode_amr(predict)
+        amr_str = finalize_amr(amr_str if amr_str is not None else "fail")
+        f1, _, _ = compute_smatch_f1(gold, penman_to_one_line(amr_str))
+        f1_scores.append(f1)
+
+    stats = model.stats
+    return {
+        "backend": backend,
+        "device": device,
+        "seconds": elapsed,
+        "tokens_per_sec": stats["new_tokens"] / stats["seconds"] if stats["seconds"] else 0.0,
+        "smatch": sum(f1_scores) / len(f1_scores) if f1_scores else 0.0,
+    }
+
+
+def main(args):
+    df = read_amr_direct(args.gold_file).head(args.num_samples)
+    sentences, golds = df["query"].tolist(), df["amr"].tolist()
+    print(f"Benchmarking {len(sentences)} sentences from {args.gold_file}")
+
+    results = [run_backend(args, backend, sentences, golds) for backend in args.backends.split(",")]
+    reference = results[0]
+    for r in results:
+        print(f"{r['backend']:>12} on {r['device']:<7} {r['tokens_per_sec']:8.1f} tokens/s  "
+              f"{r['seconds']:8.1f}s  Smatch {r['smatch']:.4f}  "
+              f"(drop vs {reference['backend']}: {reference['smatch'] - r['smatch']:+.4f})")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare inference backends on throughput and Smatch.")
+    parser.add_argument("--model_name", type=str, required=True)
+    parser.add_argument("--gold_file", type=str, required=True, help="AMR file with #::snt sentences and gold graphs")
+    parser.add_argument("--backends", type=str, default=",".join(BACKENDS), help=f"Comma-separated, first is the reference: {BACKENDS}")
+    parser.add_argument("--device", type=str, default="cuda:0" if torch.cuda.is_available() else "cpu", help="Device for the hf backend")
+    parser.add_argument("--num_samples", type=int, default=50, help="Number of sentences from the start of gold_file")
+    parser.add_argument("--batch_size", type=int, default=4)
+    parser.add_argument("--max_new_tokens", type=int, default=2048)
+    parser.add_argument("--num_threads", type=int, default=0, help="CPU threads (0 = one per physical core)")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    main(args)
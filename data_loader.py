@@ -1,9 +1,14 @@
 import pandas as pd
 from datasets import Dataset
+import hashlib
 import json
+import os
+import shutil
+import time
 
 from .prompt import *
 from .data_processing import *
+from .smatch_fast import amr_triples, triples_hash
 
 
 # def get_data(train_path1, dep_path, train_path2=None, type="grpo"):
@@ -57,51 +62,156 @@ from .data_processing import *
 #     train_dataset = process_df(df, deps_data)
 #     return train_dataset
 
-def get_data(train_path1, train_path2=None, type="grpo"):
-    df = read_amr_direct(train_path1)
+# Bump when the dataset layout changes so stale caches are rebuilt
+DATASET_CACHE_VERSION = 2
+CACHE_MARKER = "viamr_cache.json"
+
+USER_PROMPT_TEMPLATE = (
+    "Chuyển câu sau thành biểu diễn AMR dạng chuỗi PENMAN một dòng theo đúng quy tắc trên."
+    "Câu: {sentence}\n"
+)
+
+
+def dataset_cache_key(paths, type):
+    """sha256 over the corpus files' content, the prompts and the dataset type."""
+    h = hashlib.sha256()
+    h.update(json.dumps({
+        "version": DATASET_CACHE_VERSION,
+        "type": type,
+        "system_prompt": SYSTEM_PROMPT,
+        "user_prompt": USER_PROMPT_TEMPLATE,
+    }, ensure_ascii=False).encode("utf-8"))
+    for path in paths:
+        h.update(b"\0")
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+    return h.hexdigest()
+
+
+def get_data(train_path1, train_path2=None, type="grpo", num_proc=1, cache_dir=None, cache_timeout=3600, tokenizer=None):
+    """
+    Build the SFT/GRPO dataset from one or two `#::snt` corpora.
+
+    With `cache_dir`, the dataset is saved there as Arrow, keyed by
+    `dataset_cache_key`, and later launches memory-map it instead of parsing
+    the corpora again. Under torchrun only LOCAL_RANK 0 builds the cache; the
+    other ranks wait up to `cache_timeout` seconds for its marker file.
+    `tokenizer` only adds token statistics to the build log.
+    """
+    if not cache_dir:
+        return build_dataset(train_path1, train_path2, type, num_proc, tokenizer)
+
+    paths = [path for path in (train_path1, train_path2) if path]
+    cache_path = os.path.join(cache_dir, f"{type}-{dataset_cache_key(paths, type)[:16]}")
+    marker = os.path.join(cache_path, CACHE_MARKER)
+    local_rank = int(os.environ.get("LOCAL_RANK", 0))
+    if local_rank != 0 and not os.path.exists(marker):
+        print(f"Rank {local_rank} waiting for the dataset cache {cache_path}")
+        deadline = time.time() + cache_timeout
+        while not os.path.exists(marker) and time.time() < deadline:
+            time.sleep(2)
+    if os.path.exists(marker):
+        print(f"[Success] Loaded cached dataset from {cache_path}")
+        return Dataset.load_from_disk(cache_path)
+    if local_rank != 0:
+        print(f"[Warning] Timed out waiting for {cache_path}, building the dataset on rank {local_rank}")
+        return build_dataset(train_path1, train_path2, type, num_proc, tokenizer)
+
+    start_time = time.time()
+    dataset = build_dataset(train_path1, train_path2, type, num_proc, tokenizer)
+    # Write to a temporary directory and rename it, so readers never see a partial cache
+    tmp_path = f"{cache_path}.tmp-{os.getpid()}"
+    dataset.save_to_disk(tmp_path)
+    with open(os.path.join(tmp_path, CACHE_MARKER), "w", encoding="utf-8") as f:
+        json.dump({"paths": paths, "type": type, "version": DATASET_CACHE_VERSION, "rows": len(dataset)}, f, ensure_ascii=False)
+    try:
+        os.rename(tmp_path, cache_path)
+    except OSError:
+        # Another node sharing cache_dir finished first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+    print(f"[Success] Built dataset cache {cache_path} in {time.time() - start_time:.1f}s")
+    return Dataset.load_from_disk(cache_path)
+
+
+def gold_structures(amr_str):
+    """
+    Smatch variables, triples and hash of a gold AMR, stored with the GRPO
+    dataset so the reward does not re-parse it for every completion. A graph
+    smatch cannot parse gets empty lists and an empty hash.
+    """
+    try:
+        variables, triples = amr_triples(amr_str)
+    except Exception:
+        return [], [], ""
+    return variables, triples, triples_hash(variables, triples)
+
+
+def format_batch(batch, type="grpo"):
+    """
+    Batched `Dataset.map` function: `query`/`amr` columns -> GRPO (`prompt`,
+    `answers`, `gold_variables`, `gold_triples`, `gold_hash`) or SFT
+    (`prompt`, `completion`).
+    """
+    prompts = [
+        [
+            {"role": "system", "content": SYSTEM_PROMPT},
+            {"role": "user", "content": USER_PROMPT_TEMPLATE.format(sentence=sentence)}
+        ]
+        for sentence in batch["query"]
+    ]
+    if type == "grpo":
+        variables, triples, hashes = zip(*map(gold_structures, batch["amr"])) if batch["amr"] else ((), (), ())
+        return {
+            "prompt": prompts,
+            "answers": batch["amr"],
+            "gold_variables": list(variables),
+            "gold_triples": list(triples),
+            "gold_hash": list(hashes)
+        }
+    return {
+        "prompt": prompts,
+        "completion": [[{"role": "assistant", "content": f"<answer>{amr}</answer>"}] for amr in batch["amr"]]
+    }
+
+
+def count_tokens(batch, tokenizer=None):
+    """Batched `Dataset.map` function: chat-template prompt and answer lengths in tokenizer tokens."""
+    input_ids = tokenizer.apply_chat_template(batch["prompt"], tokenize=True, add_generation_prompt=True, return_dict=False)
+    answers = batch["answers"] if "answers" in batch else [c[0]["content"] for c in batch["completion"]]
+    output_ids = tokenizer(answers, add_special_tokens=False)["input_ids"]
+    return {
+        "input_tokens": [len(ids) for ids in input_ids],
+        "output_tokens": [len(ids) for ids in output_ids]
+    }
+
+
+def build_dataset(train_path1, train_path2=None, type="grpo", num_proc=1, tokenizer=None):
+    """
+    Parse the corpora and format them column-wise with batched `Dataset.map`.
+    With `tokenizer`, prompt (chat template included) and answer lengths are
+    reported in tokens.
+    """
+    df = read_amr_direct(train_path1, num_proc=num_proc)
     if train_path2:
-        df2 = read_amr_direct(train_path2)
+        df2 = read_amr_direct(train_path2, num_proc=num_proc)
         df = pd.concat([df, df2], ignore_index=True)
 
-    def process_df(df):
-        processed = []
-        max_length_input = 0
-        max_length_output = 0
-        for idx, row in df.iterrows():
-            sentence = row["query"]
-            user_prompt = (
-                f"Chuyển câu sau thành biểu diễn AMR dạng chuỗi PENMAN một dòng theo đúng quy tắc trên."
-                f"Câu: {sentence}\n"
-            )
-            max_length_input = max(max_length_input, len(user_prompt.split(" ")))
-            max_length_output = max(max_length_output, len(row['amr'].split(" ")))
-            prompt = [
-                {"role": "system", "content": SYSTEM_PROMPT},
-                {"role": "user", "content": user_prompt}
-            ]
-            if type == "grpo":  
-                
-                processed.append({
-                    "prompt": prompt,
-                    "answers": row['amr']
-                })
-            else:
-                # user_prompt = (
-                #     f"{SYSTEM_PROMPT}\n\n"
-                #     f"Chuyển câu sau thành biểu diễn AMR dạng chuỗi PENMAN một dòng theo đúng quy tắc trên."
-                #     f"Câu: {sentence}\n"
-                # )
-                # max_length_input = max(max_length_input, len(user_prompt.split(" ")))
-                # max_length_output = max(max_length_output, len(row['amr'].split(" ")))
-                processed.append({
-                    "prompt": prompt,
-                    "completion": [
-                        {"role": "assistant", "content": f"<answer>{row['amr']}</answer>"}
-                    ]
-                })
-
-        print(f"Max input length: {max_length_input}, Max output length: {max_length_output}")
-        return Dataset.from_list(processed)
-
-    train_dataset = process_df(df)
-    return train_dataset
+    map_proc = num_proc if num_proc > 1 else None
+    dataset = Dataset.from_pandas(df[["query", "amr"]], preserve_index=False)
+    dataset = dataset.map(
+        format_batch, fn_kwargs={"type": type}, batched=True, num_proc=map_proc,
+        remove_columns=["query", "amr"], desc="Formatting prompts"
+    )
+
+    if tokenizer is not None:
+        lengths = dataset.map(
+            count_tokens, fn_kwargs={"tokenizer": tokenizer}, batched=True, num_proc=map_proc,
+            remove_columns=dataset.column_names, desc="Counting tokens"
+        )
+        for column in ("input_tokens", "output_tokens"):
+            values = lengths[column]
+            if values:
+                print(f"{column}: max {max(values)}, mean {sum(values) / len(values):.1f}")
+    print(f"Dataset size: {len(dataset)}")
+    return dataset
@@ -1,7 +1,8 @@
-import pandas as pd
 import re
-import io
+import logging
 import contextlib
+import multiprocessing
+from functools import partial
 import penman
 from penman.models.noop import NoOpModel
 
@@ -32,65 +33,149 @@ def fix_multiword_nodes(graph_str):
     return fixed_str
 
 
-def decode_with_warnings(graph_str, sent):
-    f = io.StringIO()
-    with contextlib.redirect_stderr(f):
-        try:
-            graph = penman.decode(graph_str, model=NoOpModel())
-            warnings = f.getvalue()
-            if warnings.strip():
-                print(f"Warning(s) during decoding sentence: {sent}")
-                print(warnings)
-            return graph, None
-        except Exception as e:
-            return None, e
+class WarningCollector(logging.Handler):
+    """Keep the messages penman logs while decoding instead of printing them."""
 
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.messages = []
 
-def read_amr_direct(filename, one_line=True):
-    with open(filename, 'r', encoding='utf-8') as f:
-        lines = f.read().strip().split('\n')
+    def emit(self, record):
+        self.messages.append(record.getMessage())
 
-    queries = []
-    amr_list = []
+
+_collector = None
+
+
+def _start_collecting():
+    """Route penman's log records to a WarningCollector; returns the logger's old `propagate`."""
+    global _collector
+    _collector = WarningCollector()
+    logger = logging.getLogger("penman")
+    logger.addHandler(_collector)
+    propagate, logger.propagate = logger.propagate, False
+    return propagate
+
+
+def _stop_collecting(propagate):
+    global _collector
+    logger = logging.getLogger("penman")
+    logger.removeHandler(_collector)
+    logger.propagate = propagate
+    _collector = None
+
+
+@contextlib.contextmanager
+def collect_penman_warnings():
+    if _collector is not None:
+        yield
+        return
+    propagate = _start_collecting()
+    try:
+        yield
+    finally:
+        _stop_collecting(propagate)
+
+
+def decode_with_warnings(graph_str):
+    """
+    Decode `graph_str`, returning (graph, error, warnings) where `warnings`
+    are the messages penman logged for it (e.g. missing targets).
+    """
+    with collect_penman_warnings():
+        _collector.messages = []
+        try:
+            graph = penman.decode(graph_str, model=NoOpModel())
+            return graph, None, _collector.messages
+        except Exception as e:
+            return None, e, _collector.messages
+
+
+def parse_amr_block(block, one_line=True):
+    """
+    Fix and re-encode one `(sentence, amr)` record from `iter_amr_blocks`.
+
+    Returns:
+        tuple: (sentence, encoded AMR or None if it does not decode, warnings, error)
+    """
+    sent, amr_str = block
+    graph_str = "\n".join(line.strip() for line in amr_str.split("\n"))
+    graph_str = fix_missing_closing_brackets(graph_str)
+    graph_str = fix_multiword_nodes(graph_str)
+    graph, error, warnings = decode_with_warnings(graph_str)
+    if error:
+        return sent, None, warnings, str(error)
+    amr_str = penman.encode(graph, model=NoOpModel())
+    if one_line:
+        amr_str = penman_to_one_line(amr_str)
+    return sent, amr_str, warnings, None
+
+
+def iter_amr_blocks(filename):
+    """
+    Stream `(sentence, amr)` records from a `#::snt` corpus line by line, in
+    constant memory. The AMR keeps its original lines (minus trailing
+    whitespace and blank lines); blocks without graph lines are skipped.
+    """
     current_sent = None
     current_graph_lines = []
-
-    for line in lines:
-        line = line.strip()
-        if line.startswith("#::snt"):
-            # save previous block
-            if current_sent is not None and current_graph_lines:
-                graph_str = "\n".join(current_graph_lines).strip()
-                graph_str = fix_missing_closing_brackets(graph_str)
-                graph_str = fix_multiword_nodes(graph_str)
-                graph, error = decode_with_warnings(graph_str, current_sent)
-                if not error:
-                    amr_str = penman.encode(graph, model=NoOpModel())
-                    if one_line:
-                        amr_str = penman_to_one_line(amr_str)
-                    queries.append(current_sent)
-                    amr_list.append(amr_str)
+    with open(filename, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip()
+            if line.lstrip().startswith("#::snt"):
+                if current_sent is not None and current_graph_lines:
+                    yield current_sent, "\n".join(current_graph_lines)
+                current_sent = line.lstrip()[len("#::snt"):].strip()
                 current_graph_lines = []
-            current_sent = line[len("#::snt"):].strip()
-        elif line == "":
-            continue
-        else:
-            current_graph_lines.append(line)
-
-    # process last block
+            elif line:
+                current_graph_lines.append(line)
     if current_sent is not None and current_graph_lines:
-        graph_str = "\n".join(current_graph_lines).strip()
-        graph_str = fix_missing_closing_brackets(graph_str)
-        graph_str = fix_multiword_nodes(graph_str)
-        graph, error = decode_with_warnings(graph_str, current_sent)
-        if not error:
-            amr_str = penman.encode(graph, model=NoOpModel())
-            if one_line:
-                amr_str = penman_to_one_line(amr_str)
-            queries.append(current_sent)
-            amr_list.append(amr_str)
+        yield current_sent, "\n".join(current_graph_lines)
+
+
+def read_amr_direct(filename, one_line=True, num_proc=1):
+    """
+    Parse a `#::snt` corpus into a DataFrame with `query` and `amr` columns.
 
+    With `num_proc > 1` the blocks are decoded by a process pool; the order of
+    the file is kept. Blocks that fail to decode are dropped. Structured
+    diagnostics are kept in `df.attrs`: "warnings" (penman log messages) and
+    "errors" (dropped blocks), each a list of dicts with the sentence.
+    """
+    import pandas as pd
+
+    queries = []
+    amr_list = []
+    warnings = []
+    errors = []
+    parse = partial(parse_amr_block, one_line=one_line)
+    pool = None
+    if num_proc > 1:
+        # Workers collect penman warnings for their whole lifetime
+        pool = multiprocessing.Pool(num_proc, initializer=_start_collecting)
+        results = pool.imap(parse, iter_amr_blocks(filename), chunksize=64)
+    else:
+        results = map(parse, iter_amr_blocks(filename))
+    try:
+        # Installed once for the serial path, not once per graph
+        with collect_penman_warnings():
+            for sent, amr_str, block_warnings, error in results:
+                warnings.extend({"query": sent, "message": message} for message in block_warnings)
+                if error:
+                    errors.append({"query": sent, "error": error})
+                    continue
+                queries.append(sent)
+                amr_list.append(amr_str)
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+
+    if warnings or errors:
+        print(f"[Warning] {filename}: {len(warnings)} decoding warnings, {len(errors)} blocks dropped (see df.attrs)")
     df = pd.DataFrame({"query": queries, "amr": amr_list})
+    df.attrs["warnings"] = warnings
+    df.attrs["errors"] = errors
     return df
 
 
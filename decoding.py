@@ -0,0 +1,330 @@
+from functools import lru_cache
+
+import torch
+from transformers import LogitsProcessor, StoppingCriteria
+
+from .penman_prefix import ANSWER_OPEN, ANSWER_CLOSE, PenmanPrefixChecker, check_answer_body
+
+
+@lru_cache(maxsize=4)
+def vocab_texts(tokenizer):
+    """Decoded text of every token id (cached per tokenizer)."""
+    return [tokenizer.decode([i]) for i in range(len(tokenizer))]
+
+
+@lru_cache(maxsize=4)
+def answer_opener_ids(tokenizer):
+    """
+    Token ids that can complete <answer>: index 0 lists tokens containing the
+    whole tag, index k those starting with its last len(ANSWER_OPEN) - k chars.
+    """
+    texts = vocab_texts(tokenizer)
+    openers = [[i for i, t in enumerate(texts) if ANSWER_OPEN in t]]
+    for k in range(1, len(ANSWER_OPEN)):
+        openers.append([i for i, t in enumerate(texts) if t.startswith(ANSWER_OPEN[k:])])
+    return openers
+
+
+def answer_search_starts(input_ids, prompt_length, think_end_id=None):
+    """
+    Per row, the token index from which the real answer is searched: right
+    after the first generated </think> when `think_end_id` is set (None while
+    the row is still thinking), otherwise the end of the prompt. The prompt
+    shows <answer>...</answer>, so a model may write the tags while thinking.
+    """
+    if think_end_id is None:
+        return [prompt_length] * input_ids.shape[0]
+    hits = input_ids[:, prompt_length:] == think_end_id
+    if not hits.shape[1]:
+        return [None] * input_ids.shape[0]
+    first = hits.int().argmax(dim=1).tolist()
+    return [prompt_length + f + 1 if hit else None for f, hit in zip(first, hits.any(dim=1).tolist())]
+
+
+class PenmanLogitsProcessor(LogitsProcessor):
+    """
+    Grammar-constrained decoding for the text inside <answer>...</answer>.
+
+    At each step the `top_k` highest-scoring tokens are checked against a
+    `PenmanPrefixChecker` for the answer generated so far; every other token
+    is masked. Tokens that would complete <answer> are checked on the text
+    they add after it. When no token is legal the row is forced to end
+    (`eos_token_id`) rather than left unconstrained, so an answer closed with
+    </answer> always decodes with `penman.decode`. With `think_end_id`, only
+    text after </think> is constrained; thinking is untouched.
+
+    Works with any tokenizer exposing `decode` and `__len__`, so it can be
+    exercised on CPU with a tiny model and a fake tokenizer.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, top_k: int = 64, think_end_id=None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.top_k = top_k
+        self.think_end_id = think_end_id
+        self.token_texts = vocab_texts(tokenizer)
+        self.special_ids = set(getattr(tokenizer, "all_special_ids", []))
+        self.stop_id = getattr(tokenizer, "eos_token_id", None)
+        if self.stop_id is None:
+            self.stop_id = getattr(tokenizer, "pad_token_id", None)
+        # Short tokens to search when none of the top_k is allowed
+        self.fallback_ids = [
+            i for i, t in enumerate(self.token_texts)
+            if 0 < len(t) <= 2 and i not in self.special_ids
+        ]
+        self.opener_ids = answer_opener_ids(tokenizer)
+        self._rows = {}
+
+    def _answer_state(self, row, text):
+        """Return (checker, tail) for the open answer in `text`, or None if the answer is closed."""
+        body = text[text.find(ANSWER_OPEN) + len(ANSWER_OPEN):]
+        if ANSWER_CLOSE in body:
+            return None
+
+        cut = body.find("<")
+        graph, tail = (body, "") if cut < 0 else (body[:cut], body[cut:])
+        seen, checker = self._rows.get(row, ("", None))
+        if checker is None or not graph.startswith(seen):
+            seen, checker = "", PenmanPrefixChecker()
+        checker.feed(graph[len(seen):])
+        self._rows[row] = (graph, checker)
+        return checker, tail
+
+    def _allowed(self, checker, tail, token_id):
+        if token_id in self.special_ids:
+            return False
+        text = self.token_texts[token_id]
+        if not text:
+            return False
+        if tail:
+            if not checker.is_complete:
+                return False
+            text = tail + text
+            return ANSWER_CLOSE.startswith(text) or text.startswith(ANSWER_CLOSE)
+        return check_answer_body(checker.copy(), text)
+
+    def _bad_openers(self, text):
+        """Tokens that would complete <answer> after `text` followed by an invalid answer prefix."""
+        candidates = list(self.opener_ids[0])
+        for k in range(1, len(ANSWER_OPEN)):
+            if text.endswith(ANSWER_OPEN[:k]):
+                candidates += self.opener_ids[k]
+        pending = text[-(len(ANSWER_OPEN) - 1):]
+        bad = []
+        for token_id in candidates:
+            joined = pending + self.token_texts[token_id]
+            rest = joined[joined.find(ANSWER_OPEN) + len(ANSWER_OPEN):]
+            if rest and not check_answer_body(PenmanPrefixChecker(), rest):
+                bad.append(token_id)
+        return bad
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        starts = answer_search_starts(input_ids, self.prompt_length, self.think_end_id)
+        for row, start in enumerate(starts):
+            if start is None:
+                continue
+            text = self.tokenizer.decode(input_ids[row, start:].tolist(), skip_special_tokens=True)
+            if ANSWER_OPEN not in text:
+                bad = self._bad_openers(text)
+                if bad:
+                    scores[row, bad] = float("-inf")
+                continue
+            state = self._answer_state(row, text)
+            if state is None:
+                continue
+            checker, tail = state
+
+            allowed = []
+            if checker.valid:
+                k = min(self.top_k, scores.shape[-1])
+                candidates = torch.topk(scores[row], k).indices.tolist()
+                allowed = [t for t in candidates if self._allowed(checker, tail, t)]
+                if not allowed:
+                    allowed = [t for t in self.fallback_ids if self._allowed(checker, tail, t)]
+            if not allowed:
+                # Dead end: end the row instead of letting it write an invalid graph
+                allowed = [self.stop_id]
+
+            mask = torch.full_like(scores[row], float("-inf"))
+            mask[allowed] = 0
+            scores[row] = scores[row] + mask
+        return scores
+
+
+class ThinkingBudgetProcessor(LogitsProcessor):
+    """
+    Force `</think>` once a row has generated `budget` tokens without closing
+    its thinking block, so the model moves on to the answer.
+    """
+
+    def __init__(self, prompt_length: int, budget: int, think_end_id: int):
+        self.prompt_length = prompt_length
+        self.budget = budget
+        self.think_end_id = think_end_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor) -> torch.FloatTensor:
+        generated = input_ids[:, self.prompt_length:]
+        if generated.shape[1] < self.budget:
+            return scores
+        force = ~(generated == self.think_end_id).any(dim=1)
+        if force.any():
+            scores[force] = float("-inf")
+            scores[force, self.think_end_id] = 0
+        return scores
+
+
+class AnswerStoppingCriteria(StoppingCriteria):
+    """
+    Stop each row as soon as `</answer>` appears in its generated text, after
+    </think> when `think_end_id` is set (answer tags written while thinking
+    do not count).
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, window: int = 8, think_end_id=None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        # Number of trailing tokens decoded per step; </answer> spans only a few tokens
+        self.window = window
+        self.think_end_id = think_end_id
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        length = input_ids.shape[1]
+        done = []
+        for row, start in enumerate(answer_search_starts(input_ids, self.prompt_length, self.think_end_id)):
+            if start is None:
+                done.append(False)
+                continue
+            tail = self.tokenizer.decode(input_ids[row, max(start, length - self.window):].tolist(), skip_special_tokens=True)
+            done.append(ANSWER_CLOSE in tail)
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+class PenmanPrefixValidator(StoppingCriteria):
+    """
+    Stop a row as soon as the text inside <answer> can no longer become a valid
+    PENMAN graph (stray ')' at depth 0, reused variable, role with no target,
+    ...), instead of letting it run to the end and fail `penman.decode`.
+
+    Stopped rows are recorded in `aborted` as row -> (valid_length, answer_start):
+    the sequence length at the last symbol boundary before the offending token
+    and the token index the answer is decoded from, so the caller can resample
+    from the valid prefix.
+    Line breaks in the answer count as blanks. `answer_starts` (row -> token
+    index) resumes validation of sequences whose <answer> is already in the
+    prompt, e.g. when continuing an aborted row. With `think_end_id`, an
+    <answer> is only looked for after </think>.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, window: int = 8, answer_starts=None, think_end_id=None):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.window = window
+        self.think_end_id = think_end_id
+        self.aborted = {}
+        # row -> [answer_start, last valid length, body seen, checker]
+        self._rows = {row: [start, None, "", PenmanPrefixChecker()] for row, start in (answer_starts or {}).items()}
+        self._closed = set()
+
+    def _check(self, row, ids, search_start):
+        """Return False when the answer prefix of `ids` is invalid."""
+        state = self._rows.get(row)
+        if state is None:
+            if search_start is None:
+                return True
+            start = max(search_start, len(ids) - self.window)
+            if ANSWER_OPEN not in self.tokenizer.decode(ids[start:], skip_special_tokens=True):
+                return True
+            state = self._rows[row] = [start, len(ids) - 1, "", PenmanPrefixChecker()]
+
+        start, valid_length, seen, checker = state
+        text = self.tokenizer.decode(ids[start:], skip_special_tokens=True)
+        open_at = text.find(ANSWER_OPEN)
+        if open_at < 0:
+            return True
+        body = text[open_at + len(ANSWER_OPEN):]
+        cut = body.find("<")
+        if cut >= 0:
+            # The answer is closing; AnswerStoppingCriteria takes it from here
+            self._closed.add(row)
+            body = body[:cut]
+        body = body.replace("\r", " ").replace("\n", " ")
+        if not body.startswith(seen):
+            seen, checker = "", PenmanPrefixChecker()
+        checker.feed(body[len(seen):])
+        if not checker.valid:
+            self.aborted[row] = (valid_length if valid_length is not None else len(ids) - 1, start)
+            return False
+        # Resample from the last symbol boundary, not from inside a variable or role
+        state[1:] = [len(ids) if not checker.buffer else valid_length, body, checker]
+        return True
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        done = []
+        starts = answer_search_starts(input_ids, self.prompt_length, self.think_end_id)
+        for row, search_start in enumerate(starts):
+            if row in self.aborted:
+                done.append(True)
+            elif row in self._closed:
+                done.append(False)
+            else:
+                done.append(not self._check(row, input_ids[row].tolist(), search_start))
+        return torch.tensor(done, dtype=torch.bool, device=input_ids.device)
+
+
+if __name__ == "__main__":
+    import penman
+
+    class CharTokenizer:
+        """Fake tokenizer: one token per character."""
+        vocab = list("()/: abcxyz-\"<>answer_") + ["</answer>", " :ARG0", " :mod", "<eos>"]
+        eos_token_id = len(vocab) - 1
+        all_special_ids = [eos_token_id]
+
+        def __len__(self):
+            return len(self.vocab)
+
+        def decode(self, ids, skip_special_tokens=False):
+            return "".join(self.vocab[i] for i in ids)
+
+    tokenizer = CharTokenizer()
+    prompt = [tokenizer.vocab.index(ch) for ch in "<answer>"]
+    torch.manual_seed(0)
+    for trial in range(20):
+        input_ids = torch.tensor([prompt])
+        processor = PenmanLogitsProcessor(tokenizer, prompt_length=0)
+        for _ in range(200):
+            scores = processor(input_ids, torch.randn(1, len(tokenizer)))
+            next_id = int(torch.argmax(scores[0]))
+            input_ids = torch.cat([input_ids, torch.tensor([[next_id]])], dim=-1)
+            text = tokenizer.decode(input_ids[0].tolist())
+            if ANSWER_CLOSE in text or next_id == tokenizer.eos_token_id:
+                break
+        answer = text[len(ANSWER_OPEN):].split(ANSWER_CLOSE)[0]
+        if ANSWER_CLOSE in text:
+            penman.decode(answer)
+        print(f"Trial {trial}: {text}")
+
+    # The validator stops each row at its first invalid token and keeps the valid prefix length
+    tokenizer.vocab += ["\n"]
+
+    def encode(text):
+        ids = []
+        while text:
+            token = max((t for t in tokenizer.vocab if text.startswith(t)), key=len)
+            ids.append(tokenizer.vocab.index(token))
+            text = text[len(token):]
+        return ids
+
+    answers = ["(a / b :ARG0 (c / x))</answer>", "(a / b))", "(a / b :ARG0 (a / c))", "(a / b\n :ARG0 :mod c)"]
+    rows = [prompt + encode(answer) for answer in answers]
+    width = max(len(row) for row in rows)
+    rows = [row + [tokenizer.vocab.index(" ")] * (width - len(row)) for row in rows]
+    validator = PenmanPrefixValidator(tokenizer, prompt_length=0)
+    for length in range(len(prompt), len(rows[0]) + 1):
+        stopped = validator(torch.tensor([row[:length] for row in rows]), None)
+    for row, answer in enumerate(answers):
+        if row in validator.aborted:
+            valid_length, _ = validator.aborted[row]
+            print(f"Aborted {answer!r}, valid prefix: {tokenizer.decode(rows[row][len(prompt):valid_length])!r}")
+        else:
+            print(f"Kept {answer!r}")
@@ -1,33 +1,45 @@
 import argparse
+from itertools import zip_longest
 
-from .data_processing import read_amr
-from .reward import compute_smatch_f1
+from .data_processing import iter_amr_blocks, penman_to_one_line
+from .reward import compute_smatch_f1, configure_smatch_cache, configure_smatch_engine, flush_smatch_cache, smatch_cache_stats
 def main(args):
-    predict_df = read_amr(args.predict_file)
-    gold_df = read_amr(args.gold_file)
-    predicts = predict_df["target"].tolist()
-    golds = gold_df["target"].tolist()
-    print(f"Number of predictions: {len(predicts)}, Number of golds: {len(golds)}")
+    configure_smatch_engine(args.smatch_engine, restarts=args.smatch_restarts)
+    configure_smatch_cache(args.smatch_cache_size, args.smatch_cache_path)
+    # Stream both files; only the running sums are kept
+    n_predicts = n_golds = n = 0
+    f1_total = precision_total = recall_total = 0.0
+    for predict, gold in zip_longest(iter_amr_blocks(args.predict_file), iter_amr_blocks(args.gold_file)):
+        n_predicts += predict is not None
+        n_golds += gold is not None
+        if predict is None or gold is None:
+            continue
+        f1, p, r = compute_smatch_f1(penman_to_one_line(gold[1]), penman_to_one_line(predict[1]))
+        f1_total += f1
+        precision_total += p
+        recall_total += r
+        n += 1
+    flush_smatch_cache()
+    print(f"Number of predictions: {n_predicts}, Number of golds: {n_golds}")
 
-    f1_scores = []
-    precision_scores = []
-    recall_scores = []
-    for i in range(len(predict_df)):
-        predict_amr = predicts[i]
-        gold_amr = golds[i]
-        f1, p, r = compute_smatch_f1(predict_amr, gold_amr)
-        f1_scores.append(f1)
-        precision_scores.append(p)
-        recall_scores.append(r) 
-    
-    f1_avg = sum(f1_scores) / len(f1_scores)
-    precision_avg = sum(precision_scores) / len(precision_scores)
-    recall_avg = sum(recall_scores) / len(recall_scores)
+    if not n:
+        print("[Error] No AMR pairs to score")
+        return
+    f1_avg = f1_total / n
+    precision_avg = precision_total / n
+    recall_avg = recall_total / n
     print(f"F1 Score: {f1_avg:.4f}, Precision: {precision_avg:.4f}, Recall: {recall_avg:.4f}")
+    stats = smatch_cache_stats()
+    if stats:
+        print(f"Smatch cache: {stats['hits']}/{stats['hits'] + stats['misses']} hits ({stats['hit_rate']:.1%})")
 
 if __name__ == "__main__":
     arg_parser = argparse.ArgumentParser(description="Compute AMR scores.")
     arg_parser.add_argument("--predict_file", type=str, required=True, help="Path to the predicted AMR file.")
     arg_parser.add_argument("--gold_file", type=str, required=True, help="Path to the gold AMR file.")
+    arg_parser.add_argument("--smatch_cache_size", type=int, default=100000, help="Smatch results kept in memory (0 disables the cache)")
+    arg_parser.add_argument("--smatch_cache_path", type=str, default=None, help="SQLite file persisting smatch results across runs")
+    arg_parser.add_argument("--smatch_engine", type=str, default="reference", choices=["reference", "fast"], help='"reference" (smatch package) or "fast" (smatch_fast, seeded NumPy hill-climbing)')
+    arg_parser.add_argument("--smatch_restarts", type=int, default=4, help="Random restarts of the fast engine")
     args = arg_parser.parse_args()
     main(args)
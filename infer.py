@@ -1,31 +1,201 @@
-from transformers import AutoTokenizer, AutoModelForCausalLM
+from transformers import AutoTokenizer, AutoModelForCausalLM, LogitsProcessorList, StoppingCriteriaList, BatchEncoding
 import torch
+import copy
+import os
 import penman
-from penman.models.noop import NoOpModel
-from trl import SFTTrainer, SFTConfig
 import time
 import re
-import pandas as pd
-import ast
 from typing import List, Tuple
 
-from .data_processing import *
 from .postprocessing import *
 from .prompt import SYSTEM_PROMPT
+from .decoding import PenmanLogitsProcessor, ThinkingBudgetProcessor, AnswerStoppingCriteria, PenmanPrefixValidator
+
+THINK_END_TOKEN_ID = 151668  # </think>
+BACKENDS = ("hf", "hf-cpu-int8")
+
+
+def default_num_threads():
+    """CPUs available to this process, counting one thread per physical core when SMT is on."""
+    available = len(os.sched_getaffinity(0)) if hasattr(os, "sched_getaffinity") else os.cpu_count()
+    try:
+        with open("/sys/devices/system/cpu/smt/active") as f:
+            if f.read().strip() == "1":
+                available //= 2
+    except OSError:
+        pass
+    return max(1, available)
+
+
+def load_causal_lm(model_name, device="cuda:0", backend="hf"):
+    """
+    Load a causal LM for inference.
+
+    - "hf": bfloat16 weights on `device`
+    - "hf-cpu-int8": float32 weights on CPU with dynamic int8 quantization of
+      every nn.Linear (weights stored as int8, activations quantized per batch)
+    """
+    if backend == "hf-cpu-int8":
+        model = AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.float32)
+        return torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return AutoModelForCausalLM.from_pretrained(model_name, torch_dtype=torch.bfloat16).to(device)
+
 
 class QwenReasoner:
-    def __init__(self, base_model="model", lora_path="lora_path", use_lora=0, lora_r=16, lora_alpha=32, lora_dropout=0.05, device="cuda:0"):
-        self.model = AutoModelForCausalLM.from_pretrained(
-            base_model,
-            torch_dtype=torch.bfloat16
-        ).to(device)
+    def __init__(self, model_name="model", lora_path="lora_path", use_lora=0, lora_r=16, lora_alpha=32, lora_dropout=0.05, device="cuda:0", use_prefix_cache=0,
+                 enable_thinking=True, max_thinking_tokens=None, stop_on_answer=True, draft_model_name=None,
+                 backend="hf", num_threads=None, validate_prefix=False, max_resamples=2):
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend!r}, expected one of {BACKENDS}")
+        if backend == "hf-cpu-int8":
+            device = "cpu"
+        if str(device) == "cpu":
+            torch.set_num_threads(num_threads or default_num_threads())
+        self.backend = backend
+        self.model = load_causal_lm(model_name, device=device, backend=backend)
         self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+        if self.tokenizer.pad_token is None:
+            self.tokenizer.pad_token = self.tokenizer.eos_token
+        # Left padding keeps every prompt flush against its first generated token.
+        self.tokenizer.padding_side = "left"
         if use_lora:
             self.model = PeftModel.from_pretrained(self.model, lora_path).eval()
         else:
             self.model = self.model.eval()
 
-    def inference(self, prompt: str, max_new_tokens: int = 2048, is_extract_amr: bool = False, is_thinking=False) -> str:
+        # Optional small draft model (same tokenizer) for assisted generation
+        self.draft_model = None
+        if draft_model_name:
+            self.draft_model = load_causal_lm(draft_model_name, device=device, backend=backend).eval()
+
+        # target/draft forwards are counted by hooks; the assisted_* keys only cover assisted generate calls
+        self.stats = {"generate_calls": 0, "new_tokens": 0, "seconds": 0.0, "target_forwards": 0, "draft_forwards": 0,
+                      "assisted_new_tokens": 0, "assisted_target_forwards": 0, "assisted_draft_forwards": 0,
+                      "aborted_rows": 0, "resampled_rows": 0}
+        self.model.register_forward_hook(lambda *_: self._count("target_forwards"))
+        if self.draft_model is not None:
+            self.draft_model.register_forward_hook(lambda *_: self._count("draft_forwards"))
+
+        # enable_thinking=False uses the chat template's no-think mode (empty <think> block);
+        # max_thinking_tokens forces </think> after that many generated tokens.
+        self.enable_thinking = enable_thinking
+        self.max_thinking_tokens = max_thinking_tokens
+        self.stop_on_answer = stop_on_answer
+        # validate_prefix stops a row once its answer is invalid PENMAN and
+        # resamples it from the last valid prefix, up to max_resamples times.
+        self.validate_prefix = validate_prefix
+        self.max_resamples = max_resamples
+
+        self.prefix_ids = None
+        self.prefix_cache = None
+        if use_prefix_cache:
+            self.build_prefix_cache()
+
+    def _count(self, key):
+        self.stats[key] += 1
+
+    def stats_summary(self) -> str:
+        """
+        Throughput of all generate calls so far. With a draft model, each target
+        forward of an assisted call verifies the drafted tokens and adds one
+        token of its own, so accepted drafts = new tokens - target forwards, and
+        tokens per target forward is the speedup over plain decoding in forward
+        passes. Only assisted calls count: prefix-cache builds, checks and
+        unassisted calls (several sequences, resampling) are left out.
+        """
+        s = self.stats
+        summary = (
+            f"Generated {s['new_tokens']} tokens in {s['seconds']:.1f}s "
+            f"({s['new_tokens'] / s['seconds'] if s['seconds'] else 0.0:.1f} tokens/s, {s['generate_calls']} generate calls)"
+        )
+        if s["aborted_rows"]:
+            summary += f"; {s['aborted_rows']} invalid answers stopped early, {s['resampled_rows']} rows resampled"
+        if self.draft_model is not None and s["assisted_target_forwards"]:
+            accepted = max(s["assisted_new_tokens"] - s["assisted_target_forwards"], 0)
+            drafted = s["assisted_draft_forwards"]
+            acceptance = accepted / drafted if drafted else 0.0
+            summary += (
+                f"; draft acceptance {acceptance:.2%} ({accepted}/{drafted}), "
+                f"{s['assisted_new_tokens'] / s['assisted_target_forwards']:.2f} tokens per target forward"
+            )
+        return summary
+
+    def build_prefix_cache(self):
+        """
+        Prefill the chat-template prefix shared by every prompt (system prompt
+        and instructions, up to the blank line before the sentence) once, so
+        each request only prefills its own suffix.
+        """
+        marker = "\x00"
+        text = self.build_text(marker)
+        # Cut on a newline: BPE merges never cross it, so the prefix tokens are
+        # the same whether or not a sentence follows.
+        prefix_text = text[:text.rindex("\n", 0, text.index(marker)) + 1]
+        self.prefix_ids = self.tokenizer(prefix_text)["input_ids"]
+        with torch.no_grad():
+            outputs = self.model(
+                input_ids=torch.tensor([self.prefix_ids], device=self.model.device),
+                use_cache=True
+            )
+        self.prefix_cache = outputs.past_key_values
+        print(f"Cached {len(self.prefix_ids)} prefix tokens")
+
+    def encode(self, texts: List[str], num_return_sequences: int = 1):
+        """
+        Tokenize chat texts for `generate`.
+
+        When the prefix cache is built and every text starts with the cached
+        prefix ids, rows are laid out as [prefix | pad | suffix] so the prefix
+        keeps positions 0..P-1 in each row and a copy of the cache is attached
+        as `past_key_values`, expanded to len(texts) * num_return_sequences
+        rows (generate does not expand caches itself). Otherwise texts are
+        left-padded as usual.
+        """
+        if self.prefix_cache is not None:
+            prefix_len = len(self.prefix_ids)
+            suffixes = []
+            for ids in self.tokenizer(texts)["input_ids"]:
+                if ids[:prefix_len] != self.prefix_ids:
+                    break
+                suffixes.append(ids[prefix_len:])
+            else:
+                width = max(len(suffix) for suffix in suffixes)
+                pad_id = self.tokenizer.pad_token_id
+                input_ids = [self.prefix_ids + [pad_id] * (width - len(suffix)) + suffix for suffix in suffixes]
+                attention_mask = [[1] * prefix_len + [0] * (width - len(suffix)) + [1] * len(suffix) for suffix in suffixes]
+                past_key_values = copy.deepcopy(self.prefix_cache)
+                past_key_values.batch_repeat_interleave(len(texts) * num_return_sequences)
+                model_inputs = BatchEncoding({
+                    "input_ids": torch.tensor(input_ids, device=self.model.device),
+                    "attention_mask": torch.tensor(attention_mask, device=self.model.device),
+                })
+                model_inputs["past_key_values"] = past_key_values
+                return model_inputs
+        return self.tokenizer(texts, return_tensors="pt", padding=True).to(self.model.device)
+
+    def check_prefix_cache(self, prompts: List[str], max_new_tokens: int = 32) -> bool:
+        """Greedy-decode `prompts` with and without the prefix cache and compare token for token."""
+        texts = [self.build_text(prompt) for prompt in prompts]
+        cached_inputs = self.encode(texts)
+        plain_inputs = self.tokenizer(texts, return_tensors="pt", padding=True).to(self.model.device)
+        cached = self.generate(cached_inputs, max_new_tokens=max_new_tokens, do_sample=False)
+        plain = self.generate(plain_inputs, max_new_tokens=max_new_tokens, do_sample=False)
+
+        pad_id = self.tokenizer.pad_token_id
+        matched = True
+        for row, prompt in enumerate(prompts):
+            cached_ids = cached[row][cached_inputs.input_ids.shape[1]:].tolist()
+            plain_ids = plain[row][plain_inputs.input_ids.shape[1]:].tolist()
+            while cached_ids and cached_ids[-1] == pad_id:
+                cached_ids.pop()
+            while plain_ids and plain_ids[-1] == pad_id:
+                plain_ids.pop()
+            if cached_ids != plain_ids:
+                print(f"[Warning] Prefix cache output differs from uncached output for: {prompt}")
+                matched = False
+        return matched
+
+    def build_text(self, prompt: str) -> str:
         user_prompt = (
                     f"{SYSTEM_PROMPT}\n\n"
                     f"Chuyển câu sau thành biểu diễn AMR dạng chuỗi PENMAN một dòng theo đúng quy tắc trên."
@@ -34,36 +204,193 @@ class QwenReasoner:
         messages = [
             {"role": "user", "content": user_prompt}
         ]
-        text = self.tokenizer.apply_chat_template(
+        return self.tokenizer.apply_chat_template(
             messages,
             tokenize=False,
-            add_generation_prompt=True
+            add_generation_prompt=True,
+            enable_thinking=self.enable_thinking
         )
-        model_inputs = self.tokenizer([text], return_tensors="pt").to(self.model.device)
 
-        generated_ids = self.model.generate(
-            **model_inputs,
-            max_new_tokens=max_new_tokens
-        )
+    def split_output(self, output_ids: List[int], is_extract_amr: bool = False, is_thinking=False) -> Tuple[str, str]:
+        """Split generated ids (prompt removed) into (thinking, content)."""
         if is_thinking:
-            output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist() 
-
             try:
-                index = len(output_ids) - output_ids[::-1].index(151668)
+                index = len(output_ids) - output_ids[::-1].index(THINK_END_TOKEN_ID)
             except ValueError:
                 index = 0
 
             thinking_content = self.tokenizer.decode(output_ids[:index], skip_special_tokens=True).strip("\n")
             content = self.tokenizer.decode(output_ids[index:], skip_special_tokens=True).strip("\n")
-            if is_extract_amr:
-                return thinking_content, self.extract_answer(content)
-            return thinking_content, content
-        generated_ids = [
-            output_ids[len(input_ids):] for input_ids, output_ids in zip(model_inputs.input_ids, generated_ids)
-        ]
+        else:
+            thinking_content = None
+            content = self.tokenizer.decode(output_ids, skip_special_tokens=True)
         if is_extract_amr:
-            return None, self.extract_answer(self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0])
-        return None, self.tokenizer.batch_decode(generated_ids, skip_special_tokens=True)[0]
+            return thinking_content, self.extract_answer(content)
+        return thinking_content, content
+
+    def generate(self, model_inputs, max_new_tokens: int = 2048, constrained: bool = False, **generate_kwargs):
+        """
+        Run `model.generate` on tokenized inputs.
+
+        With `constrained=True`, a PenmanLogitsProcessor masks tokens that would
+        make the text inside <answer> unparseable by PENMAN. Generation stops at
+        </answer> unless `stop_on_answer` is off, and thinking is cut after
+        `max_thinking_tokens` when set. With `validate_prefix`, rows whose answer
+        becomes invalid PENMAN are stopped and resampled (see `_resample`).
+        """
+        prompt_length = model_inputs.input_ids.shape[1]
+        logits_processor = LogitsProcessorList()
+        stopping_criteria = StoppingCriteriaList()
+        if self.enable_thinking and self.max_thinking_tokens:
+            logits_processor.append(
+                ThinkingBudgetProcessor(prompt_length, self.max_thinking_tokens, THINK_END_TOKEN_ID)
+            )
+        # Answer tags written while thinking are ignored: the real answer follows </think>
+        think_end_id = THINK_END_TOKEN_ID if self.enable_thinking else None
+        if constrained:
+            logits_processor.append(PenmanLogitsProcessor(self.tokenizer, prompt_length=prompt_length, think_end_id=think_end_id))
+        if self.stop_on_answer:
+            stopping_criteria.append(AnswerStoppingCriteria(self.tokenizer, prompt_length, think_end_id=think_end_id))
+        validator = None
+        if self.validate_prefix:
+            validator = PenmanPrefixValidator(self.tokenizer, prompt_length, think_end_id=think_end_id)
+            stopping_criteria.append(validator)
+        num_sequences = model_inputs.input_ids.shape[0] * generate_kwargs.get("num_return_sequences", 1)
+        assisted = self.draft_model is not None and num_sequences == 1
+        if assisted:
+            generate_kwargs["assistant_model"] = self.draft_model
+        forwards = (self.stats["target_forwards"], self.stats["draft_forwards"])
+
+        start_time = time.time()
+        generated_ids = self.model.generate(
+            **model_inputs,
+            max_new_tokens=max_new_tokens,
+            logits_processor=logits_processor,
+            stopping_criteria=stopping_criteria,
+            **generate_kwargs
+        )
+        self.stats["seconds"] += time.time() - start_time
+        self.stats["generate_calls"] += 1
+        new_tokens = int((generated_ids[:, prompt_length:] != self.tokenizer.pad_token_id).sum())
+        self.stats["new_tokens"] += new_tokens
+        if assisted:
+            self.stats["assisted_new_tokens"] += new_tokens
+            self.stats["assisted_target_forwards"] += self.stats["target_forwards"] - forwards[0]
+            self.stats["assisted_draft_forwards"] += self.stats["draft_forwards"] - forwards[1]
+        if validator is not None and validator.aborted:
+            prompt_mask = model_inputs.attention_mask
+            if prompt_mask.shape[0] != generated_ids.shape[0]:
+                prompt_mask = prompt_mask.repeat_interleave(generated_ids.shape[0] // prompt_mask.shape[0], dim=0)
+            generated_ids = self._resample(generated_ids, prompt_mask, validator.aborted, max_new_tokens)
+        return generated_ids
+
+    def _resample(self, generated_ids, prompt_mask, aborted, max_new_tokens):
+        """
+        Continue rows stopped by PenmanPrefixValidator by sampling from their
+        last valid prefix, so the thinking and the valid part of the answer are
+        kept. Rows still invalid after `max_resamples` rounds keep their
+        truncated output. Returns the sequences right-padded to one tensor.
+        """
+        pad_id = self.tokenizer.pad_token_id
+        prompt_length = prompt_mask.shape[1]
+        sequences = [ids.tolist() for ids in generated_ids]
+        masks = [mask.tolist() for mask in prompt_mask]
+        self.stats["aborted_rows"] += len(aborted)
+        for _ in range(self.max_resamples):
+            if not aborted:
+                break
+            rows = sorted(aborted)
+            prefixes = [sequences[row][:aborted[row][0]] for row in rows]
+            # The generated part of a running row has no padding
+            prefix_masks = [masks[row] + [1] * (len(prefix) - prompt_length) for row, prefix in zip(rows, prefixes)]
+            width = max(len(prefix) for prefix in prefixes)
+            pads = [width - len(prefix) for prefix in prefixes]
+            input_ids = torch.tensor([[pad_id] * pad + prefix for pad, prefix in zip(pads, prefixes)], device=self.model.device)
+            attention_mask = torch.tensor([[0] * pad + mask for pad, mask in zip(pads, prefix_masks)], device=self.model.device)
+
+            validator = PenmanPrefixValidator(
+                self.tokenizer, width,
+                answer_starts={j: pad + aborted[row][1] for j, (pad, row) in enumerate(zip(pads, rows))}
+            )
+            stopping_criteria = StoppingCriteriaList([validator])
+            if self.stop_on_answer:
+                stopping_criteria.append(AnswerStoppingCriteria(self.tokenizer, width))
+            start_time = time.time()
+            new_ids = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=attention_mask,
+                max_new_tokens=max(max_new_tokens - (len(prefix) - prompt_length) for prefix in prefixes),
+                stopping_criteria=stopping_criteria,
+                do_sample=True
+            )
+            self.stats["seconds"] += time.time() - start_time
+            self.stats["generate_calls"] += 1
+            self.stats["new_tokens"] += int((new_ids[:, width:] != pad_id).sum())
+            self.stats["resampled_rows"] += len(rows)
+
+            next_aborted = {}
+            for j, (pad, row) in enumerate(zip(pads, rows)):
+                sequences[row] = new_ids[j, pad:].tolist()
+                if j in validator.aborted:
+                    valid_length, answer_start = validator.aborted[j]
+                    next_aborted[row] = (valid_length - pad, answer_start - pad)
+            aborted = next_aborted
+
+        width = max(len(ids) for ids in sequences)
+        return torch.tensor([ids + [pad_id] * (width - len(ids)) for ids in sequences], device=generated_ids.device)
+
+    def inference(self, prompt: str, max_new_tokens: int = 2048, is_extract_amr: bool = False, is_thinking=False, constrained: bool = False) -> str:
+        text = self.build_text(prompt)
+        model_inputs = self.encode([text])
+
+        generated_ids = self.generate(model_inputs, max_new_tokens=max_new_tokens, constrained=constrained)
+        output_ids = generated_ids[0][len(model_inputs.input_ids[0]):].tolist()
+        return self.split_output(output_ids, is_extract_amr=is_extract_amr, is_thinking=is_thinking)
+
+    def inference_candidates(self, prompt: str, num_candidates: int = 4, max_new_tokens: int = 2048, is_extract_amr: bool = False, is_thinking=False, constrained: bool = False) -> List[Tuple[str, str]]:
+        """Sample `num_candidates` outputs for one prompt in a single generate call."""
+        text = self.build_text(prompt)
+        model_inputs = self.encode([text], num_return_sequences=num_candidates)
+
+        generated_ids = self.generate(
+            model_inputs,
+            max_new_tokens=max_new_tokens,
+            constrained=constrained,
+            do_sample=True,
+            num_return_sequences=num_candidates
+        )
+        prompt_len = model_inputs.input_ids.shape[1]
+        return [
+            self.split_output(output_ids[prompt_len:].tolist(), is_extract_amr=is_extract_amr, is_thinking=is_thinking)
+            for output_ids in generated_ids
+        ]
+
+    def inference_batch(self, prompts: List[str], batch_size: int = 8, max_new_tokens: int = 2048, is_extract_amr: bool = False, is_thinking=False, constrained: bool = False, **generate_kwargs) -> List[Tuple[str, str]]:
+        """
+        Batched version of `inference`.
+
+        Prompts are sorted by token length so each left-padded batch holds
+        sequences of similar size; results are returned in the input order.
+        `generate_kwargs` (e.g. `do_sample=False`) are passed to `generate`.
+        """
+        if self.draft_model is not None:
+            # Assisted generation only supports one sequence per call
+            batch_size = 1
+        texts = [self.build_text(prompt) for prompt in prompts]
+        lengths = [len(ids) for ids in self.tokenizer(texts)["input_ids"]]
+        order = sorted(range(len(texts)), key=lambda i: lengths[i], reverse=True)
+
+        results = [None] * len(texts)
+        for start in range(0, len(order), batch_size):
+            batch_idx = order[start:start + batch_size]
+            model_inputs = self.encode([texts[i] for i in batch_idx])
+
+            generated_ids = self.generate(model_inputs, max_new_tokens=max_new_tokens, constrained=constrained, **generate_kwargs)
+            prompt_len = model_inputs.input_ids.shape[1]
+            for row, i in enumerate(batch_idx):
+                output_ids = generated_ids[row][prompt_len:].tolist()
+                results[i] = self.split_output(output_ids, is_extract_amr=is_extract_amr, is_thinking=is_thinking)
+        return results
 
     @staticmethod
     def extract_answer(text: str) -> str:
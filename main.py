@@ -1,16 +1,496 @@
+import time
+_import_start = time.perf_counter()
+
 import penman
 from penman.models.noop import NoOpModel
 import os
-from .infer import QwenReasoner
+import re
+import json
+import importlib
+from collections import Counter
+from .amr_cache import AMRCache
+from .repair import diagnose, repair_amr
 from .postprocessing import *
 from .data_processing import *
 
+# Heavy modules (torch, transformers via .infer) are imported on first use
+IMPORT_TIMES = {"startup (penman, stdlib)": time.perf_counter() - _import_start}
+
+
+def timed_import(name):
+    """Import `name` (relative to this package if it starts with '.') and record how long it took."""
+    start = time.perf_counter()
+    module = importlib.import_module(name, __package__)
+    IMPORT_TIMES.setdefault(name, time.perf_counter() - start)
+    return module
+
+
+def print_import_times():
+    for name, seconds in IMPORT_TIMES.items():
+        print(f"[Import] {name}: {seconds:.3f}s")
+
+
+def normalize_sentence(line):
+    return line.lower().replace("_", " ")
+
+
+def decode_amr(predict):
+    """Return the re-encoded AMR string, or None if PENMAN cannot decode it."""
+    try:
+        predict = join_concepts_underscores(predict)
+        graph = penman.decode(predict)
+        return penman.encode(graph)
+    except Exception:
+        return None
+
+
+def finalize_amr(amr_str):
+    """Sanitize and re-encode `amr_str`; "fail" if the result is empty or does not decode."""
+    try:
+        amr_str = penman_safe_minimal(amr_str)
+        print(f"[Success] Processed AMR")
+        graph = penman.decode(amr_str)
+        amr_str = penman.encode(graph)
+    except Exception as e:
+        print(f"[Error] Failed to process AMR after retries: {e}")
+        return "fail"
+    # An empty record would shift every later prediction/gold pair in get_score
+    return amr_str if amr_str.strip() else "fail"
+
+
+def decode_or_repair(predict, repairs=None):
+    """
+    Decode `predict`, falling back to `repair_amr` so mechanical errors do not
+    cost a regeneration. With `repairs`, graphs that decode are still checked
+    with `diagnose` (duplicate variables, roles without a target) and repaired
+    too. Successful repairs are counted in `repairs` by strategy.
+    """
+    amr_str = decode_amr(predict)
+    if repairs is None:
+        return amr_str
+    if amr_str is not None:
+        predict = join_concepts_underscores(predict)
+        errors, _ = diagnose(predict)
+        if not errors:
+            return amr_str
+    repaired, applied = repair_amr(predict)
+    if not applied:
+        return amr_str
+    amr_str = repaired
+    if amr_str is not None:
+        strategy = " + ".join(applied)
+        repairs[strategy] += 1
+        print(f"[Success] Repaired AMR with {strategy}")
+    return amr_str
+
+
+def print_repair_stats(repairs):
+    if repairs:
+        print("Repairs: " + ", ".join(f"{strategy}: {count}" for strategy, count in repairs.most_common()))
+
+
+def structural_score(predict):
+    """Sort key ranking undecodable answers by how close they are to a valid graph."""
+    return (
+        decode_amr(penman_safe_minimal(predict)) is not None,
+        check_balanced_parens(predict),
+        check_unique_vars(predict),
+        check_var_word_conflict(predict),
+        bool(predict),
+    )
+
+
+def parse_with_candidates(model, line, args, max_tries, repairs=None):
+    """
+    Sample `args.num_candidates` answers per generate call (fewer once less
+    than that remains of `max_tries`) and return the first one that decodes,
+    with the number of failed candidates. When none decodes,
+    the candidates are repaired (best `structural_score` first, if `repairs` is
+    given) before sampling again. If every round fails, return the candidate
+    with the best `structural_score` so the sanitizer gets the most promising
+    input, or "fail" if even that one does not sanitize into a graph.
+    """
+    best, failures = None, 0
+    while failures < max_tries:
+        outputs = model.inference_candidates(
+            normalize_sentence(line),
+            num_candidates=min(args.num_candidates, max_tries - failures),
+            max_new_tokens=args.max_new_tokens,
+            is_extract_amr=True,
+            is_thinking=True,
+            constrained=bool(args.constrained)
+        )
+        for thinking, predict in outputs:
+            amr_str = decode_amr(predict)
+            if amr_str is not None:
+                return amr_str, failures
+            failures += 1
+            if best is None or structural_score(predict) > structural_score(best):
+                best = predict
+        if repairs is not None:
+            for predict in sorted((predict for _, predict in outputs), key=structural_score, reverse=True):
+                amr_str = decode_or_repair(predict, repairs)
+                if amr_str is not None:
+                    return amr_str, failures
+        print(f"[Error] No decodable AMR among {len(outputs)} candidates (tries: {failures})")
+    if best is None or finalize_amr(best) == "fail":
+        return "fail", failures
+    return best, failures
+
+
+def manifest_path(output_file):
+    return output_file + ".manifest"
+
+
+# The AMR may be empty: "#::snt idx line\n\n\n"
+RECORD_RE = re.compile(rb"#::snt (\d+) ([^\n]*)\n((?:[^\n]+\n)+|\n)\n")
+
+
+def iter_records(content):
+    """Yield (idx, line, amr_str, end_offset) for consecutive complete records in `content` (bytes)."""
+    offset = 0
+    for m in RECORD_RE.finditer(content):
+        if m.start() != offset:
+            break
+        offset = m.end()
+        yield int(m.group(1)), m.group(2).decode("utf-8"), m.group(3).decode("utf-8").rstrip("\n"), offset
+
+
+def read_manifest(output_file):
+    """Return ([(idx, end offset), ...] of the complete manifest lines, their size in bytes)."""
+    entries = []
+    size = 0
+    with open(manifest_path(output_file), "rb") as f:
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # torn last line
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                break
+            entries.append((record["idx"], record["offset"]))
+            size += len(line)
+    return entries, size
+
+
+def committed_records(output_file):
+    """
+    Cut `output_file` into its committed records at the manifest offsets.
+
+    Returns:
+        list: (idx, record bytes) in file order, or None (with an error) when
+        the file and its manifest disagree, so callers never rewrite a file
+        they only partly understand.
+    """
+    entries, _ = read_manifest(output_file)
+    with open(output_file, "rb") as f:
+        content = f.read()
+    records = []
+    start = 0
+    for idx, end in entries:
+        chunk = content[start:end]
+        if end < start or not chunk.startswith(f"#::snt {idx} ".encode("utf-8")) or not chunk.endswith(b"\n\n"):
+            print(f"[Error] {output_file} does not match its manifest at record {idx}")
+            return None
+        records.append((idx, chunk))
+        start = end
+    if start != len(content):
+        print(f"[Error] {output_file} has {len(content) - start} bytes beyond its manifest")
+        return None
+    return records
+
+
+def load_progress(output_file):
+    """
+    Return the indices already committed to `output_file` and truncate any
+    partially written record after the last commit.
+
+    The sidecar manifest holds one JSON line per committed record with the byte
+    size of the output file after that record. A torn last line is truncated
+    away, so the next `commit_record` starts on a fresh line. Without a
+    manifest, complete `#::snt idx` blocks (terminated by a blank line) are
+    parsed from the output and the manifest is rebuilt from them.
+    """
+    done = set()
+    offset = 0
+    if os.path.exists(manifest_path(output_file)):
+        entries, manifest_size = read_manifest(output_file)
+        done.update(idx for idx, _ in entries)
+        if entries:
+            offset = entries[-1][1]
+        if os.path.getsize(manifest_path(output_file)) > manifest_size:
+            print(f"[Warning] Dropping torn tail of {manifest_path(output_file)}")
+            os.truncate(manifest_path(output_file), manifest_size)
+    elif os.path.exists(output_file):
+        with open(output_file, "rb") as f:
+            content = f.read()
+        records = []
+        for idx, _, _, offset in iter_records(content):
+            done.add(idx)
+            records.append({"idx": idx, "offset": offset})
+        with open(manifest_path(output_file), "w", encoding="utf-8") as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+
+    if os.path.exists(output_file) and os.path.getsize(output_file) > offset:
+        print(f"[Warning] Dropping uncommitted tail of {output_file}")
+        with open(output_file, "r+b") as f:
+            f.truncate(offset)
+    return done
+
+
+def commit_chunk(out_f, manifest_f, idx, chunk):
+    """Append one encoded record, then mark it committed in the manifest (both fsynced)."""
+    out_f.write(chunk)
+    out_f.flush()
+    os.fsync(out_f.fileno())
+    offset = os.fstat(out_f.fileno()).st_size
+    manifest_f.write(json.dumps({"idx": idx, "offset": offset}) + "\n")
+    manifest_f.flush()
+    os.fsync(manifest_f.fileno())
+
+
+def commit_record(out_f, manifest_f, idx, line, amr_str):
+    """Append one record, then mark it committed in the manifest (both fsynced)."""
+    commit_chunk(out_f, manifest_f, idx, f"#::snt {idx} {line}\n{amr_str}\n\n".encode("utf-8"))
+
+
+def sort_output(output_file):
+    """
+    Rewrite `output_file` (and its manifest) in `#::snt idx` order; resumed runs
+    append out of order. Records are moved as they are, cut at the manifest
+    offsets, and the file is left alone if it does not match its manifest.
+    """
+    records = committed_records(output_file)
+    if records is None:
+        print(f"[Error] Not sorting {output_file}")
+        return
+    if [idx for idx, _ in records] == sorted(idx for idx, _ in records):
+        return
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "wb") as out_f, \
+            open(manifest_path(tmp_file), "w", encoding="utf-8") as manifest_f:
+        for idx, chunk in sorted(records, key=lambda record: record[0]):
+            commit_chunk(out_f, manifest_f, idx, chunk)
+    os.replace(tmp_file, output_file)
+    os.replace(manifest_path(tmp_file), manifest_path(output_file))
+
+
+def load_model(args, device="cuda:0", sample=(), num_threads=None):
+    QwenReasoner = timed_import(".infer").QwenReasoner
+    model = QwenReasoner(
+        model_name=args.model_name,
+        device=device,
+        backend=args.backend,
+        num_threads=num_threads,
+        use_prefix_cache=args.prefix_cache,
+        enable_thinking=bool(args.enable_thinking),
+        max_thinking_tokens=args.max_thinking_tokens or None,
+        draft_model_name=args.draft_model_name,
+        validate_prefix=bool(args.validate_prefix),
+        max_resamples=args.max_resamples
+    )
+    if args.prefix_cache and sample:
+        if not model.check_prefix_cache([normalize_sentence(line) for line in sample]):
+            print("[Warning] Prefix cache does not reproduce uncached outputs, disabling it")
+            model.prefix_cache = None
+    return model
+
+
+def open_cache(args):
+    if not args.cache_path:
+        return None
+    return AMRCache(
+        args.cache_path,
+        model_name=args.model_name,
+        # Everything that changes the outputs: a different backend or retry strategy must not reuse results
+        settings={
+            "backend": args.backend,
+            "constrained": args.constrained,
+            "enable_thinking": args.enable_thinking,
+            "max_thinking_tokens": args.max_thinking_tokens,
+            "max_new_tokens": args.max_new_tokens,
+            "validate_prefix": args.validate_prefix,
+            "max_resamples": args.max_resamples,
+            "num_candidates": args.num_candidates,
+            "repair": args.repair,
+        },
+        max_entries=args.cache_max_entries
+    )
+
+
+def print_cache_stats(cache):
+    stats = cache.stats()
+    print(f"Cache: {stats['hits']} hits, {stats['misses']} misses "
+          f"(hit rate {stats['hit_rate']:.2%}, {stats['entries']} entries)")
+
+
+def parse_items(model, items, args, cache, commit):
+    """
+    Parse (idx, line) pairs chunk by chunk and pass each finished record to
+    `commit(idx, line, amr_str)`. Returns the count of successful repairs per strategy.
+    """
+    max_retries = 100
+    repairs = Counter() if args.repair else None
+    # Sentences are length-sorted inside each chunk, so a chunk spans several batches.
+    chunk_size = args.batch_size * args.sort_window
+    for start in range(0, len(items), chunk_size):
+        chunk_idx, chunk = zip(*items[start:start + chunk_size])
+        amr_strs = ["fail"] * len(chunk)
+        retry_counts = [0] * len(chunk)
+        cached = {}
+        if cache is not None:
+            for i, line in enumerate(chunk):
+                hit = cache.get(normalize_sentence(line))
+                if hit is not None:
+                    cached[i] = hit
+        pending = [i for i in range(len(chunk)) if i not in cached]
+        while pending:
+            outputs = model.inference_batch(
+                [normalize_sentence(chunk[i]) for i in pending],
+                batch_size=args.batch_size,
+                max_new_tokens=args.max_new_tokens,
+                is_extract_amr=True,
+                is_thinking=True,
+                constrained=bool(args.constrained)
+            )
+            failed = []
+            for i, (thinking, predict) in zip(pending, outputs):
+                amr_str = decode_or_repair(predict, repairs)
+                if amr_str is not None:
+                    amr_strs[i] = amr_str
+                    continue
+                print(f"[Error] Cannot decode AMR (try {retry_counts[i]+1})")
+                retry_counts[i] += 1
+                if retry_counts[i] < max_retries:
+                    failed.append(i)
+            pending = failed
+            if args.num_candidates > 1:
+                for i in pending:
+                    amr_strs[i], failures = parse_with_candidates(model, chunk[i], args, max_retries - retry_counts[i], repairs)
+                    retry_counts[i] += failures
+                break
+
+        for i, (idx, line) in enumerate(zip(chunk_idx, chunk)):
+            if i in cached:
+                amr_str = cached[i]
+            else:
+                amr_str = finalize_amr(amr_strs[i])
+                if cache is not None and decode_amr(amr_str) is not None:
+                    cache.put(normalize_sentence(line), amr_str)
+
+            if has_duplicate_nodes(amr_str):
+                print(f"[Warning] AMR has duplicate nodes: {amr_str}")
+            commit(idx, line, amr_str)
+
+            print(f"Processed {idx}: {line} (Retries: {retry_counts[i]}): amr: {amr_str}")
+    return repairs
+
+
+def run_shard(args, shard_id, device, items, shard_file):
+    """Worker entry point: parse `items` on `device` into `shard_file` (with its own manifest)."""
+    # Workers on the same CPU split its threads
+    num_threads = max(1, timed_import(".infer").default_num_threads() // args.num_workers)
+    model = load_model(args, device=device, sample=[line for _, line in items[:2]], num_threads=num_threads)
+    cache = open_cache(args)
+    with open(shard_file, "wb") as out_f, \
+            open(manifest_path(shard_file), "w", encoding="utf-8") as manifest_f:
+        repairs = parse_items(model, items, args, cache,
+                              lambda idx, line, amr_str: commit_record(out_f, manifest_f, idx, line, amr_str))
+    print_repair_stats(repairs)
+    if cache is not None:
+        print_cache_stats(cache)
+        cache.close()
+    print(f"Shard {shard_id}: {model.stats_summary()}")
+    return len(items)
+
+
+def run_sharded(args, items, out_f, manifest_f):
+    """
+    Split `items` across `args.num_workers` processes (one QwenReasoner each),
+    then merge the committed shard records into `out_f` in `#::snt idx` order.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    devices = args.devices.split(",")
+    shards = []
+    for shard_id in range(args.num_workers):
+        shard_items = items[shard_id::args.num_workers]
+        if shard_items:
+            shard_file = f"{args.output_file}.shard{shard_id}"
+            shards.append((shard_id, devices[shard_id % len(devices)], shard_items, shard_file))
+    if not shards:
+        return
+
+    with ProcessPoolExecutor(max_workers=len(shards), mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = [(shard, executor.submit(run_shard, args, *shard)) for shard in shards]
+        failures = {}
+        for (shard_id, device, shard_items, shard_file), future in futures:
+            try:
+                future.result()
+                print(f"[Success] Shard {shard_id} on {device}: {len(shard_items)} sentences")
+            except Exception as e:
+                failures[shard_id] = e
+                print(f"[Error] Shard {shard_id} on {device} failed: {e!r}")
+
+    records = []
+    for shard_id, device, shard_items, shard_file in shards:
+        if not os.path.exists(shard_file):
+            continue
+        load_progress(shard_file)
+        shard_records = committed_records(shard_file)
+        if shard_records is None:
+            # Keep the shard files for inspection instead of merging part of them
+            failures[shard_id] = ValueError(f"{shard_file} does not match its manifest")
+            continue
+        records.extend(shard_records)
+    for idx, chunk in sorted(records, key=lambda record: record[0]):
+        commit_chunk(out_f, manifest_f, idx, chunk)
+
+    missing = len(items) - len(records)
+    if failures:
+        print(f"[Error] {len(failures)} shard(s) failed, {missing} sentences missing; rerun with --resume 1")
+    else:
+        for shard_id, device, shard_items, shard_file in shards:
+            os.remove(shard_file)
+            os.remove(manifest_path(shard_file))
+
+
+def sanitize_file(input_file, output_file):
+    """Re-run the sanitizer over an existing results file without loading a model."""
+    with open(input_file, "rb") as f:
+        records = [record[:3] for record in iter_records(f.read())]
+    with open(output_file, "ab") as out_f, \
+            open(manifest_path(output_file), "a", encoding="utf-8") as manifest_f:
+        for idx, line, amr_str in records:
+            commit_record(out_f, manifest_f, idx, line, finalize_amr(amr_str))
+    print(f"Sanitized {len(records)} AMRs from {input_file}")
+
+
 def main(args):
-    if os.path.exists(args.output_file):
-        os.remove(args.output_file)
+    if args.sanitize_only and os.path.realpath(args.input_file) == os.path.realpath(args.output_file):
+        # The output is cleared (or appended to) before the input is read
+        print(f"[Error] --sanitize_only needs an output_file different from input_file ({args.input_file})")
+        return
+    if args.resume:
+        done = load_progress(args.output_file)
+        print(f"Resuming: {len(done)} sentences already processed")
     else:
+        done = set()
+        if os.path.exists(manifest_path(args.output_file)):
+            os.remove(manifest_path(args.output_file))
+        if os.path.exists(args.output_file):
+            os.remove(args.output_file)
+    if os.path.dirname(args.output_file):
         os.makedirs(os.path.dirname(args.output_file), exist_ok=True)
 
+    if args.sanitize_only:
+        sanitize_file(args.input_file, args.output_file)
+        if args.profile_imports:
+            print_import_times()
+        return
+
     if args.my_test:
         df = read_amr_direct(args.input_file)
         lines = df["query"].tolist()
@@ -18,39 +498,29 @@ def main(args):
         with open(args.input_file, "r", encoding="utf-8") as f:
             lines = [line.strip() for line in f if line.strip()]
 
-    model = QwenReasoner(model_name=args.model_name)
-
-    with open(args.output_file, "a", encoding="utf-8") as out_f:
-        for idx, line in enumerate(lines):
-            amr_str = "fail"
-            retry_count = 0
-            max_retries = 100
-            while retry_count < max_retries:
-                thinking, predict = model.inference(line.lower().replace("_", " "), is_extract_amr=True, is_thinking=True)
-                try:
-                    predict = join_concepts_underscores(predict)
-                    graph = penman.decode(predict)
-                    amr_str = penman.encode(graph)
-                    break
-                except Exception as e:
-                    print(f"[Error] Cannot decode AMR (try {retry_count+1})")
-                    amr_str = "fail"
-                    retry_count += 1
-            try:
-                amr_str = penman_safe_minimal(amr_str)
-                print(f"[Success] Processed AMR")
-                graph = penman.decode(amr_str)
-                amr_str = penman.encode(graph)
-            except Exception as e:
-                print(f"[Error] Failed to process AMR after retries: {e}")
-
-            if has_duplicate_nodes(amr_str):
-                print(f"[Warning] AMR has duplicate nodes: {amr_str}")
-            out_f.write(f"#::snt {idx} {line}\n")
-            out_f.write(f"{amr_str}\n\n")
-            out_f.flush()
+    todo = [(idx, line) for idx, line in enumerate(lines) if idx not in done]
 
-            print(f"Processed {idx}: {line} (Retries: {retry_count}): amr: {amr_str}")
+    with open(args.output_file, "ab") as out_f, \
+            open(manifest_path(args.output_file), "a", encoding="utf-8") as manifest_f:
+        if not todo:
+            # Rerun of a finished job: no workers or model to start
+            print(f"Nothing left to process in {args.input_file}")
+        elif args.num_workers > 1:
+            run_sharded(args, todo, out_f, manifest_f)
+        else:
+            model = load_model(args, device=args.devices.split(",")[0], sample=lines[:max(args.batch_size, 2)])
+            cache = open_cache(args)
+            repairs = parse_items(model, todo, args, cache,
+                                  lambda idx, line, amr_str: commit_record(out_f, manifest_f, idx, line, amr_str))
+            print_repair_stats(repairs)
+            if cache is not None:
+                print_cache_stats(cache)
+                cache.close()
+            print(model.stats_summary())
+    if args.resume:
+        sort_output(args.output_file)
+    if args.profile_imports:
+        print_import_times()
 
     print(f"Save completed. Results saved to {args.output_file}")
 
@@ -62,6 +532,26 @@ if __name__ == "__main__":
     parser.add_argument("--output_file", type=str, required=True)
     parser.add_argument("--model_name", type=str, default="Qwen-7B")
     parser.add_argument("--my_test", type=int, default=0, help="Use for my test data")
+    parser.add_argument("--batch_size", type=int, default=1, help="Number of sentences per generate call")
+    parser.add_argument("--constrained", type=int, default=0, help="Use PENMAN grammar-constrained decoding inside <answer>")
+    parser.add_argument("--prefix_cache", type=int, default=0, help="Reuse the KV cache of the shared system-prompt prefix")
+    parser.add_argument("--resume", type=int, default=0, help="Skip sentences already committed to output_file")
+    parser.add_argument("--cache_path", type=str, default=None, help="SQLite file caching sentence -> AMR results")
+    parser.add_argument("--cache_max_entries", type=int, default=100000, help="Evict least recently used cache entries beyond this size")
+    parser.add_argument("--max_new_tokens", type=int, default=2048)
+    parser.add_argument("--enable_thinking", type=int, default=1, help="0 uses the chat template's no-think mode")
+    parser.add_argument("--max_thinking_tokens", type=int, default=0, help="Force </think> after this many tokens (0 = no limit)")
+    parser.add_argument("--backend", type=str, default="hf", help="hf (bf16) or hf-cpu-int8 (dynamic int8 on CPU)")
+    parser.add_argument("--draft_model_name", type=str, default=None, help="Small draft model for assisted (speculative) decoding")
+    parser.add_argument("--validate_prefix", type=int, default=0, help="Stop answers as soon as they become invalid PENMAN and resample them")
+    parser.add_argument("--max_resamples", type=int, default=2, help="Resampling rounds for answers stopped by --validate_prefix")
+    parser.add_argument("--repair", type=int, default=1, help="Repair undecodable AMRs (duplicate variables, dangling roles, ...) before regenerating")
+    parser.add_argument("--num_candidates", type=int, default=1, help="Retry failed sentences by sampling this many candidates per generate call")
+    parser.add_argument("--num_workers", type=int, default=1, help="Number of worker processes, each with its own model")
+    parser.add_argument("--devices", type=str, default="cuda:0", help="Comma-separated devices assigned to workers round-robin")
+    parser.add_argument("--sanitize_only", type=int, default=0, help="Only re-sanitize the AMRs of an existing results file (input_file)")
+    parser.add_argument("--profile_imports", type=int, default=0, help="Print how long module imports took")
+    parser.add_argument("--sort_window", type=int, default=16, help="Number of batches sorted together by token length")
 
     args = parser.parse_args()
     main(args)
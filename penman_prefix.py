@@ -0,0 +1,210 @@
+"""
+Incremental validator for single-line PENMAN strings.
+
+The checker is fed the text generated inside <answer>...</answer> piece by
+piece and reports as soon as the prefix can no longer be completed into a
+graph that `penman.decode` accepts:
+
+    (var / concept :role (var2 / concept2) :role2 value ...)
+"""
+
+ANSWER_OPEN = "<answer>"
+ANSWER_CLOSE = "</answer>"
+
+# Characters that end a PENMAN symbol (variable, concept, role or atom);
+# '#' would open a comment and '~' an alignment.
+_DELIMITERS = set('()/:~"#')
+# The answer is a single line, so only blanks separate tokens
+_BLANKS = " \t"
+
+# Parser states
+START = "start"                # before the top node
+OPEN = "open"                  # after '(' , expecting a variable
+VAR = "var"                    # reading a variable
+AFTER_VAR = "after_var"        # variable done, expecting '/'
+SLASH = "slash"                # after '/', expecting a concept
+CONCEPT = "concept"            # reading a concept
+STRING_CONCEPT = "str_concept" # reading a quoted concept
+IN_NODE = "in_node"            # expecting ':role' or ')'
+ROLE = "role"                  # reading a role name
+AFTER_ROLE = "after_role"      # expecting a node, a variable or a constant
+ATOM = "atom"                  # reading a variable reference or constant
+STRING = "string"              # reading a quoted constant
+DONE = "done"                  # top node closed
+
+
+class PenmanPrefixChecker:
+    """
+    Track paren depth, the `(var / concept :role ...)` state machine and the
+    variables already defined.
+
+    Example:
+        >>> c = PenmanPrefixChecker()
+        >>> c.feed("(b / bi_kịch :domain (c / chỗ")
+        True
+        >>> c.feed(") (x")
+        False
+        >>> c.error
+        "stray '(' in state in_node"
+    """
+
+    def __init__(self):
+        self.state = START
+        self.depth = 0
+        self.buffer = ""
+        self.variables = set()
+        self.valid = True
+        self.error = None
+
+    def copy(self):
+        other = PenmanPrefixChecker.__new__(PenmanPrefixChecker)
+        other.state = self.state
+        other.depth = self.depth
+        other.buffer = self.buffer
+        other.variables = set(self.variables)
+        other.valid = self.valid
+        other.error = self.error
+        return other
+
+    @property
+    def is_complete(self) -> bool:
+        return self.valid and self.state == DONE
+
+    def accepts(self, text: str) -> bool:
+        """Return True if `text` can be appended without invalidating the prefix."""
+        return self.copy().feed(text)
+
+    def feed(self, text: str) -> bool:
+        for ch in text:
+            if not self.valid:
+                break
+            self._step(ch)
+        return self.valid
+
+    def _fail(self, message):
+        self.valid = False
+        self.error = message
+
+    def _close_symbol(self):
+        """Finish the symbol in `buffer` for the current state."""
+        if self.state == VAR:
+            if self.buffer in self.variables:
+                self._fail(f"variable '{self.buffer}' reused")
+                return
+            self.variables.add(self.buffer)
+            self.state = AFTER_VAR
+        elif self.state == ROLE:
+            if self.buffer == ":":
+                self._fail("empty role")
+                return
+            self.state = AFTER_ROLE
+        elif self.state in (CONCEPT, ATOM):
+            self.state = IN_NODE
+        self.buffer = ""
+
+    def _close_node(self):
+        self.depth -= 1
+        self.state = DONE if self.depth == 0 else IN_NODE
+
+    def _step(self, ch):
+        state = self.state
+
+        if not ch.isprintable() and ch not in _BLANKS:
+            self._fail(f"unprintable character {ch!r}")
+            return
+
+        if state in (STRING, STRING_CONCEPT):
+            if ch == '"':
+                self.state = IN_NODE
+            elif ch == "\\":
+                self._fail("escape sequence in string")
+            return
+
+        if ch in _BLANKS:
+            if state in (VAR, ROLE, CONCEPT, ATOM):
+                self._close_symbol()
+            return
+
+        if ch == "(":
+            if state in (START, AFTER_ROLE):
+                self.depth += 1
+                self.state = OPEN
+            else:
+                self._fail(f"stray '(' in state {state}")
+        elif ch == ")":
+            if state in (CONCEPT, ATOM):
+                self._close_symbol()
+                self._close_node()
+            elif state == IN_NODE:
+                self._close_node()
+            elif state in (ROLE, AFTER_ROLE):
+                self._fail("role with no target")
+            elif state in (START, DONE):
+                self._fail("stray ')' at depth 0")
+            else:
+                self._fail(f"node closed without concept in state {state}")
+        elif ch == "/":
+            if state == VAR:
+                self._close_symbol()
+                if self.valid:
+                    self.state = SLASH
+            elif state == AFTER_VAR:
+                self.state = SLASH
+            else:
+                self._fail(f"stray '/' in state {state}")
+        elif ch == ":":
+            if state in (CONCEPT, ATOM):
+                self._close_symbol()
+                state = self.state
+            if state == IN_NODE:
+                self.state = ROLE
+                self.buffer = ":"
+            elif state in (ROLE, AFTER_ROLE):
+                self._fail("role with no target")
+            else:
+                self._fail(f"stray ':' in state {state}")
+        elif ch == '"':
+            if state == SLASH:
+                self.state = STRING_CONCEPT
+            elif state == AFTER_ROLE:
+                self.state = STRING
+            else:
+                self._fail(f"stray '\"' in state {state}")
+        elif ch in _DELIMITERS:
+            self._fail(f"unexpected '{ch}'")
+        else:
+            if state == OPEN:
+                self.state = VAR
+                self.buffer = ch
+            elif state == SLASH:
+                self.state = CONCEPT
+            elif state == AFTER_ROLE:
+                self.state = ATOM
+            elif state in (VAR, ROLE):
+                self.buffer += ch
+            elif state in (CONCEPT, ATOM):
+                pass
+            elif state == IN_NODE:
+                self._fail("expected role or ')' after concept")
+            elif state == AFTER_VAR:
+                self._fail("expected '/' after variable")
+            else:
+                self._fail(f"unexpected text in state {state}")
+
+
+def check_answer_body(checker: PenmanPrefixChecker, text: str) -> bool:
+    """
+    Check text that follows <answer>: a PENMAN prefix, optionally followed by
+    (a prefix of) </answer> once the graph is complete.
+
+    `checker` is advanced over the graph part of `text`.
+    """
+    cut = text.find("<")
+    graph, tail = (text, None) if cut < 0 else (text[:cut], text[cut:])
+    if not checker.feed(graph):
+        return False
+    if tail is None:
+        return True
+    if not checker.is_complete:
+        return False
+    return ANSWER_CLOSE.startswith(tail) or tail.startswith(ANSWER_CLOSE)
@@ -104,8 +104,267 @@ def dedup_selected_roles(amr: str, roles=()):
     return rx.sub(_sub, amr)
 
 
-# 7) Main sanitization pipeline (minimal, non-destructive)
+# 7) Single-pass sanitizer
+#    The string is tokenized once; each repair of the regex chain below then
+#    only visits the tokens it can change ('(', '/', ':'), jumping between them
+#    with list.index. Every step reproduces its regex exactly, including the
+#    fixpoint of fix_amr_vars (computed in closed form), so the result is the
+#    same as penman_safe_minimal_regex in linear time.
+_TOKEN_RE = re.compile(r'\s+|[()/:]|[^\s()/:]+')
+_ROLE_CHARS_RE = re.compile(r'[\w-]*')
+_CONCEPT_RE = re.compile(r'/|[^/]+')
+_VAR_RE = re.compile(r'\w+')
+_PAD = [''] * 4  # end-of-input tokens, so lookahead never runs off the list
+
+
+def _is_word(tok: str) -> bool:
+    return tok != '' and tok[0] not in '()/:' and not tok[0].isspace()
+
+
+def _is_text(tok: str) -> bool:
+    """Word or '/': the characters `[^\\s():]` that the regexes treat as one run."""
+    return tok == '/' or _is_word(tok)
+
+
+def _tokenize(s: str):
+    """
+    Split into tokens (blank runs, words, '(', ')', '/', ':') and apply
+    normalize_roles_spacing on the way:
+    'word:role' -> 'word :role', ':role(' -> ':role (', ':role_x' -> ':role x'.
+    """
+    tokens = _TOKEN_RE.findall(s)
+    n = len(tokens)
+    tokens.extend(_PAD)
+    out, start = [], 0
+    prev_matched = False
+    while True:
+        try:
+            c = tokens.index(':', start)
+        except ValueError:
+            break
+        out.extend(tokens[start:c])
+
+        # 'word:role' needs a space, except after a colon whose role already covers the word
+        word, after = tokens[c + 1], tokens[c + 2]
+        matched = False
+        if c > 0 and _is_text(tokens[c - 1]) and _is_word(word) and word[0].isascii() and word[0].isalpha():
+            r = c - 1
+            while r > 0 and _is_text(tokens[r - 1]):
+                r -= 1
+            if r == 0 or tokens[r - 1] != ':':
+                matched = True
+            elif prev_matched:
+                matched = c - r > 1 or _ROLE_CHARS_RE.match(tokens[r]).end() < len(tokens[r])
+            else:
+                matched = c - r > 1 or len(tokens[r]) > 1
+        if matched:
+            out.append(' ')
+        out.append(':')
+        prev_matched = matched
+        start = c + 1
+        if not _is_word(word):
+            continue
+
+        start = c + 2
+        if '_' not in word and after != '(':
+            out.append(word)
+            continue
+        role = _ROLE_CHARS_RE.match(word).group()
+        # Rightmost '_' of the role that is followed by more text
+        last = len(role) - 1
+        if last >= 1 and role[last] == '_' and (len(role) < len(word) or after == '/'):
+            split_at = last
+        else:
+            split_at = role.rfind('_', 1, last)
+        if split_at > 0:
+            out.append(word[:split_at])
+            out.append(' ')
+            if word[split_at + 1:]:
+                out.append(word[split_at + 1:])
+        else:
+            out.append(word)
+        if len(role) == len(word) and after == '(':
+            out.append(' ')
+    if start == 0:
+        return tokens
+    out.extend(tokens[start:n])
+    out.extend(_PAD)
+    return out
+
+
+def _join_concepts(tokens):
+    """join_concepts_underscores: '/ New York' -> '/ New_York'."""
+    out, start = [], 0
+    while True:
+        try:
+            i = tokens.index('/', start)
+        except ValueError:
+            break
+        out.extend(tokens[start:i + 1])
+        start = i + 1
+        ws = tokens[i + 1]
+        if not ws[:1].isspace():
+            continue
+
+        words, j = [], i + 2
+        while _is_word(tokens[j]):
+            words.append(tokens[j])
+            sep = tokens[j + 1]
+            if sep[:1].isspace() and '\n' not in sep and '\r' not in sep and _is_word(tokens[j + 2]):
+                j += 2
+            else:
+                j += 1
+                break
+        end = tokens[j + 1] if tokens[j][:1].isspace() else tokens[j]
+        if end not in (':', '/', ')', ''):
+            continue
+        if words:
+            out.append(' ')
+            out.append('_'.join(words))
+            start = j
+        else:
+            # Only blanks before the terminator: the concept group is one blank char
+            k = max((k for k in range(1, len(ws)) if ws[k] not in '\n\r'), default=0)
+            if k:
+                out.append(' ' + ws[k + 1:])
+                start = i + 2
+    out.extend(tokens[start:])
+    return out
+
+
+def _skip_run(tokens, i):
+    """Index of the first token at or after `i` that is not a word or '/'."""
+    while _is_text(tokens[i]):
+        i += 1
+    return i
+
+
+def _fix_heads(tokens):
+    """fix_amr_vars (run to its fixpoint): '(v / A / B ...' -> '(v / A ...'."""
+    out, start = [], 0
+    while True:
+        try:
+            i = tokens.index('(', start) + 1
+        except ValueError:
+            break
+        out.extend(tokens[start:i])
+        start = i
+
+        # '(' blank? var blank? '/' blank? concept
+        j = i + 1 if tokens[i][:1].isspace() else i
+        if not _is_word(tokens[j]) or not _VAR_RE.fullmatch(tokens[j]):
+            continue
+        j += 2 if tokens[j + 1][:1].isspace() else 1
+        if tokens[j] != '/':
+            continue
+        j += 2 if tokens[j + 1][:1].isspace() else 1
+        if not _is_text(tokens[j]):
+            continue
+
+        i = _skip_run(tokens, j)
+        k = i + 1 if tokens[i][:1].isspace() else i
+        if i == j + 1 and tokens[j] != '/' and tokens[k] != '/':
+            continue  # one-word concept and no second '/': nothing to fix
+        concept = ''.join(tokens[j:i])
+        changed = False
+        while True:
+            # The whole concept followed by ' / X'
+            k = i + 1 if tokens[i][:1].isspace() else i
+            if tokens[k] == '/':
+                k += 2 if tokens[k + 1][:1].isspace() else 1
+                if _is_text(tokens[k]):
+                    i = _skip_run(tokens, k)
+                    changed = True
+                    continue
+            # 'A/' followed by ' X'
+            if len(concept) > 1 and concept[-1] == '/' and tokens[i][:1].isspace() and _is_text(tokens[i + 1]):
+                concept = concept[:-1]
+                i = _skip_run(tokens, i + 1)
+                changed = True
+                continue
+            # 'A/X' inside the concept
+            k = concept.rfind('/', 1, len(concept) - 1)
+            if k > 0:
+                concept = concept[:k]
+                changed = True
+                continue
+            break
+        if changed:
+            out.extend(tokens[start:j])
+            out.extend(_CONCEPT_RE.findall(concept))
+            start = i
+    out.extend(tokens[start:])
+    return out
+
+
+def _strip_orphan_slashes(tokens):
+    """strip_orphan_slashes: drop '/' (and blanks) before ')', ':role', a newline or the end."""
+    out, start = [], 0
+    while True:
+        try:
+            i = tokens.index('/', start)
+        except ValueError:
+            break
+        out.extend(tokens[start:i])
+        start = i + 1
+        ws = tokens[i + 1] if tokens[i + 1][:1].isspace() else ''
+        j = i + 2 if ws else i + 1
+        nxt, after = tokens[j], tokens[j + 1]
+        if nxt == ')' or nxt == '' or (nxt == ':' and after != '' and (after[0] == '-' or _VAR_RE.match(after))):
+            start = j
+        elif '\n' in ws:
+            out.append(ws[ws.rfind('\n'):])
+            start = j
+        else:
+            out.append('/')
+    out.extend(tokens[start:])
+    return out
+
+
 def penman_safe_minimal(amr: str, roles_to_dedup=()):
+    """
+    Sanitize an AMR/PENMAN string in a single linear scan:
+      - Normalize spacing around roles
+      - Join multi-word concepts with underscores
+      - Fix duplicate variable headers
+      - Remove orphan slashes
+      - Balance parentheses
+      - Normalize whitespace
+
+    Gives the same result as `penman_safe_minimal_regex`, without its repeated
+    regex passes and the quadratic `fix_amr_vars` loop.
+
+    Args:
+        amr (str): AMR string
+        roles_to_dedup (tuple): optional roles to deduplicate
+
+    Returns:
+        str: sanitized AMR string
+    """
+    tokens = _strip_orphan_slashes(_fix_heads(_join_concepts(_tokenize(amr))))
+
+    # balance_parens: drop unmatched ')' and close what is still open
+    depth, stray = 0, []
+    for i, tok in enumerate(tokens):
+        if tok == '(':
+            depth += 1
+        elif tok == ')':
+            if depth:
+                depth -= 1
+            else:
+                stray.append(i)
+    if stray:
+        stray = set(stray)
+        tokens = [tok for i, tok in enumerate(tokens) if i not in stray]
+    s = ''.join(tokens) + ')' * depth
+
+    # s = dedup_selected_roles(s, roles=roles_to_dedup)  # disabled by default
+    # Collapse runs of spaces/tabs and strip
+    return ' '.join(filter(None, s.replace('\t', ' ').split(' '))).strip()
+
+
+# 8) Reference regex pipeline, kept to check penman_safe_minimal against
+def penman_safe_minimal_regex(amr: str, roles_to_dedup=()):
     """
     Apply a minimal sanitization pipeline for AMR/PENMAN strings:
       - Normalize spacing around roles
@@ -155,3 +414,94 @@ def has_duplicate_nodes(amr_str: str) -> bool:
             return True
         seen.add(var)
     return False
+
+
+def check_balanced_parens(s: str) -> bool:
+    """Kiểm tra đóng mở dấu ngoặc tròn."""
+    stack = 0
+    for ch in s:
+        if ch == '(':
+            stack += 1
+        elif ch == ')':
+            stack -= 1
+            if stack < 0:
+                return False
+    return stack == 0
+
+def check_unique_vars(amr_str: str) -> bool:
+    """Kiểm tra biến không trùng (x1, x2, ...)."""
+    vars_found = re.findall(r"\((\w+)\s*/", amr_str)
+    return len(vars_found) == len(set(vars_found))
+
+def check_var_word_conflict(amr_str: str) -> bool:
+    """
+    Trả về True nếu TẤT CẢ biến và từ đều có ký tự đầu giống nhau (ví dụ: b1 / bi_kịch).
+    Nếu có ít nhất 1 cặp không trùng -> trả về False.
+    """
+    matches = re.findall(r"\((\w+)\s*/\s*([^\s)]+)", amr_str)
+    if not matches:
+        return False 
+    
+    for var, word in matches:
+        if not word or var[0].lower() != word[0].lower():
+            return False
+    return True
+
+
+if __name__ == "__main__":
+    import argparse
+    import random
+    import time
+
+    parser = argparse.ArgumentParser(description="Check penman_safe_minimal against the regex pipeline on a golden corpus.")
+    parser.add_argument("--amr_file", type=str, default=None, help="AMR file (gold data or model outputs), graphs separated by blank lines")
+    parser.add_argument("--num_mutations", type=int, default=20, help="Corrupted variants generated per graph")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    corpus = [
+        "(w / want-01\n   :ARG0 (b / boy)\n   :ARG1 (g / go-02 :ARG0 b))",
+        "(c / city / thành_phố :name (n / name :op1 \"Hà\" :op2 \"Nội\"))",
+        "(n / nhà:ARG0(t / tôi) :mod_đẹp / ))",
+        "(x / New York / city/town :location (y /  ) :op1_New_York",
+    ]
+    if args.amr_file:
+        with open(args.amr_file, encoding="utf-8") as f:
+            blocks = f.read().split("\n\n")
+        for block in blocks:
+            graph = "\n".join(line for line in block.splitlines() if not line.startswith("#"))
+            if graph.strip():
+                corpus.append(graph)
+
+    # LLM-style damage: missing/extra parens and blanks, repeated concepts, glued roles
+    edits = ["(", ")", " / ", "/", ":", " ", "\n   ", "_", ":ARG0", " / x", "  ", "\t"]
+    rng = random.Random(args.seed)
+    cases = list(corpus)
+    for graph in corpus:
+        for _ in range(args.num_mutations):
+            s = graph
+            for _ in range(rng.randint(1, 4)):
+                pos = rng.randint(0, len(s))
+                if rng.random() < 0.3:
+                    s = s[:pos] + s[pos + 1:]
+                else:
+                    s = s[:pos] + rng.choice(edits) + s[pos:]
+            cases.append(s)
+
+    timings = {}
+    results = {}
+    for fn in (penman_safe_minimal_regex, penman_safe_minimal):
+        start_time = time.perf_counter()
+        results[fn.__name__] = [fn(s) for s in cases]
+        timings[fn.__name__] = time.perf_counter() - start_time
+
+    mismatches = [
+        (s, old, new) for s, old, new in zip(cases, results["penman_safe_minimal_regex"], results["penman_safe_minimal"])
+        if old != new
+    ]
+    for s, old, new in mismatches[:5]:
+        print(f"[Error] Mismatch on {s!r}\n  regex:       {old!r}\n  single-pass: {new!r}")
+    for name, seconds in timings.items():
+        print(f"{name}: {seconds / len(cases) * 1e6:.1f} us/graph")
+    print(f"{len(cases) - len(mismatches)}/{len(cases)} graphs identical")
+
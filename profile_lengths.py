@@ -0,0 +1,138 @@
+import argparse
+import math
+
+from .data_loader import get_data, count_tokens
+
+PERCENTILES = [50, 90, 95, 99, 99.9, 100]
+
+
+def percentile(sorted_values, q):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def round_up(value, multiple):
+    return int(math.ceil(value / multiple) * multiple)
+
+
+def print_histogram(name, values, bins=12, width=40):
+    values = sorted(values)
+    summary = ", ".join(f"p{q:g} {percentile(values, q)}" for q in PERCENTILES)
+    print(f"\n{name} ({len(values)} examples): {summary}")
+    if not values:
+        return
+    lo, hi = values[0], values[-1]
+    step = max(1, math.ceil((hi - lo + 1) / bins))
+    counts = [0] * bins
+    for value in values:
+        counts[min((value - lo) // step, bins - 1)] += 1
+    for i, count in enumerate(counts):
+        if count:
+            bar = "#" * max(1, round(width * count / max(counts)))
+            print(f"  {lo + i * step:>6}-{lo + (i + 1) * step - 1:<6} {count:>7} {bar}")
+
+
+def truncated(values, cap):
+    return sum(value > cap for value in values) / len(values) if values else 0.0
+
+
+def count_parameters(config):
+    """Approximate parameter count of a Qwen/LLaMA-style decoder from its config."""
+    h = config.hidden_size
+    head_dim = getattr(config, "head_dim", None) or h // config.num_attention_heads
+    kv_dim = getattr(config, "num_key_value_heads", config.num_attention_heads) * head_dim
+    attention = h * config.num_attention_heads * head_dim * 2 + h * kv_dim * 2
+    mlp = 3 * h * config.intermediate_size
+    embeddings = config.vocab_size * h * (1 if getattr(config, "tie_word_embeddings", False) else 2)
+    return config.num_hidden_layers * (attention + mlp) + embeddings
+
+
+def estimate_batch_size(config, seq_len, memory_gb, num_gpus=1, use_lora=False, gradient_checkpointing=False):
+    """
+    Largest per-device batch of `seq_len`-token sequences that fits in
+    `memory_gb`, for bf16 training with ZeRO-2 across `num_gpus`.
+
+    Static memory is 2 bytes/param of weights, plus gradients and Adam states
+    (14 bytes/param, sharded) unless LoRA. Activations use ~34*hidden bytes
+    per token per layer (flash attention, no recomputation), or one layer plus
+    the layer inputs with gradient checkpointing, plus the fp32 logits. A rough
+    estimate: keep a margin for the CUDA context and fragmentation.
+    """
+    n_params = count_parameters(config)
+    static = 2 * n_params if use_lora else 2 * n_params + 14 * n_params / num_gpus
+    h, layers = config.hidden_size, config.num_hidden_layers
+    if gradient_checkpointing:
+        per_token = 2 * h * layers + 34 * h
+    else:
+        per_token = 34 * h * layers
+    per_token += 6 * config.vocab_size
+    budget = 0.9 * memory_gb * 1024 ** 3 - static
+    return max(0, int(budget // (per_token * seq_len))), n_params, static
+
+
+def main(args):
+    from transformers import AutoConfig, AutoTokenizer
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name, trust_remote_code=True)
+    dataset = get_data(args.dataset1_path, args.dataset2_path, type="grpo", num_proc=args.num_proc,
+                       cache_dir=args.dataset_cache_dir)
+    lengths = dataset.map(
+        count_tokens, fn_kwargs={"tokenizer": tokenizer}, batched=True,
+        num_proc=args.num_proc if args.num_proc > 1 else None,
+        remove_columns=dataset.column_names, desc="Counting tokens"
+    )
+    prompts = lengths["input_tokens"]
+    # SFT completions are wrapped in <answer> tags and end with the end-of-turn token
+    answers = [n + len(tokenizer("<answer></answer>", add_special_tokens=False)["input_ids"]) + 1
+               for n in lengths["output_tokens"]]
+    totals = [p + a for p, a in zip(prompts, answers)]
+
+    print_histogram("Prompt tokens (chat template + system prompt)", prompts)
+    print_histogram("Answer tokens (<answer>...</answer>)", answers)
+    print_histogram("SFT sequence tokens (prompt + answer)", totals)
+
+    coverage = args.coverage * 100
+    prompt_cap = round_up(percentile(sorted(prompts), coverage), args.round_to)
+    answer_cap = round_up(percentile(sorted(answers), coverage), args.round_to)
+    sft_cap = round_up(percentile(sorted(totals), coverage), args.round_to)
+    # GRPO completions also contain the thinking, which the gold data does not show
+    completion_cap = round_up(answer_cap * args.completion_factor, args.round_to)
+
+    print(f"\nCurrent caps: --max_input_length {args.max_input_length} truncates {truncated(totals, args.max_input_length):.2%} of SFT examples, "
+          f"--max_prompt_length {args.max_prompt_length} truncates {truncated(prompts, args.max_prompt_length):.2%} of prompts")
+
+    config = AutoConfig.from_pretrained(args.model_name, trust_remote_code=True)
+    options = dict(num_gpus=args.num_gpus, use_lora=bool(args.use_lora), gradient_checkpointing=bool(args.gradient_checkpointing))
+    sft_batch, n_params, static = estimate_batch_size(config, sft_cap, args.memory_gb, **options)
+    grpo_batch, _, _ = estimate_batch_size(config, prompt_cap + completion_cap, args.memory_gb, **options)
+    print(f"Model: ~{n_params / 1e9:.2f}B parameters, ~{static / 1024 ** 3:.1f} GB static per device; budget {args.memory_gb} GB")
+
+    print(f"\nSuggested caps covering {coverage:g}% of examples:")
+    print(f"  SFT:  --max_input_length {sft_cap} --per_device_train_batch_size {sft_batch}")
+    print(f"  GRPO: --max_prompt_length {prompt_cap} --max_completion_length {completion_cap} "
+          f"--per_device_train_batch_size {grpo_batch} (answer p{coverage:g} {answer_cap} x {args.completion_factor:g} for thinking)")
+    if not sft_batch:
+        print("[Warning] Not even one sequence fits the memory budget; try --use_lora 1 or --gradient_checkpointing 1")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Profile token lengths of the training corpus and suggest length caps and batch sizes.")
+    parser.add_argument("--dataset1_path", type=str, required=True)
+    parser.add_argument("--dataset2_path", type=str, default=None)
+    parser.add_argument("--model_name", type=str, default="Qwen/Qwen3-1.7B", help="Tokenizer/chat template and config to profile with")
+    parser.add_argument("--num_proc", type=int, default=1, help="Processes used to parse and tokenize the corpus")
+    parser.add_argument("--dataset_cache_dir", type=str, default=None, help="Reuse the training dataset cache")
+    parser.add_argument("--coverage", type=float, default=0.99, help="Fraction of examples the suggested caps must fit")
+    parser.add_argument("--round_to", type=int, default=64, help="Round suggested caps up to a multiple of this")
+    parser.add_argument("--completion_factor", type=float, default=4.0, help="GRPO completion cap as a multiple of the answer cap (room for thinking)")
+    parser.add_argument("--max_input_length", type=int, default=2048, help="Current SFT cap to check for truncation")
+    parser.add_argument("--max_prompt_length", type=int, default=512, help="Current GRPO prompt cap to check for truncation")
+    parser.add_argument("--memory_gb", type=float, default=80, help="Memory per device")
+    parser.add_argument("--num_gpus", type=int, default=2, help="Devices sharing ZeRO-2 optimizer states")
+    parser.add_argument("--use_lora", type=int, default=0)
+    parser.add_argument("--gradient_checkpointing", type=int, default=0)
+    args = parser.parse_args()
+    main(args)
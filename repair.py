@@ -0,0 +1,184 @@
+import re
+from collections import Counter
+
+import penman
+from penman.exceptions import DecodeError
+
+from .postprocessing import balance_parens, penman_safe_minimal
+
+_NODE_RE = re.compile(r'\(\s*([^\s()/:"]+)\s*/')
+_SYMBOL = r'[^\s()/:"]+'
+
+
+def close_strings(amr_str: str) -> str:
+    """Close an unterminated string literal right after its first word: ':op1 "Hà)' -> ':op1 "Hà")'."""
+    if amr_str.count('"') % 2 == 0:
+        return amr_str
+    start = amr_str.rfind('"') + 1
+    end = start
+    while end < len(amr_str) and not amr_str[end].isspace() and amr_str[end] not in '()':
+        end += 1
+    return amr_str[:end] + '"' + amr_str[end:]
+
+
+def join_multiword_concepts(amr_str: str) -> str:
+    """'(c / thành phố :mod ...' -> '(c / thành_phố :mod ...'."""
+    return re.sub(
+        rf'(/\s*)({_SYMBOL}(?:[ \t]+{_SYMBOL})+)',
+        lambda m: m.group(1) + '_'.join(m.group(2).split()),
+        amr_str
+    )
+
+
+def insert_missing_slashes(amr_str: str) -> str:
+    """'(c thành_phố :mod ...' -> '(c / thành_phố :mod ...'."""
+    return re.sub(rf'\(\s*({_SYMBOL})\s+(?=[^\s()/:"])', r'(\1 / ', amr_str)
+
+
+def _fresh_variable(used, base):
+    base = base[:1].lower() if base[:1].isalpha() else "x"
+    n = 1
+    while f"{base}{n}" in used:
+        n += 1
+    used.add(f"{base}{n}")
+    return f"{base}{n}"
+
+
+def add_missing_variables(amr_str: str) -> str:
+    """'(/ nhà)' -> '(n1 / nhà)'."""
+    used = set(_NODE_RE.findall(amr_str))
+    return re.sub(
+        r'\(\s*/\s*([^\s()/:]*)',
+        lambda m: f"({_fresh_variable(used, m.group(1))} / {m.group(1)}",
+        amr_str
+    )
+
+
+def drop_dangling_roles(amr_str: str) -> str:
+    """Remove roles with no target: '(a / b :ARG0 :ARG1 (c / d))' -> '(a / b :ARG1 (c / d))'."""
+    return re.sub(r'\s*:[^\s()":]+(?=\s*(?::|\)|$))', '', amr_str)
+
+
+def rename_duplicate_variables(amr_str: str) -> str:
+    """
+    Give every repeated node variable a fresh name: '(n / nhà :mod (n / nhỏ))'
+    -> '(n / nhà :mod (n1 / nhỏ))'. Re-entrant references keep pointing at the
+    first node with that variable.
+    """
+    used = set(_NODE_RE.findall(amr_str))
+    seen = set()
+
+    def _rename(m):
+        var = m.group(1)
+        if var not in seen:
+            seen.add(var)
+            return m.group(0)
+        return m.group(0).replace(var, _fresh_variable(used, var), 1)
+
+    return _NODE_RE.sub(_rename, amr_str)
+
+
+# (name, repair, error types it targets), cheapest first
+STRATEGIES = [
+    ("close_string", close_strings, {"unterminated_string"}),
+    ("balance_parens", balance_parens, {"unbalanced_parens"}),
+    ("join_concept", join_multiword_concepts, {"multiword_concept"}),
+    ("insert_slash", insert_missing_slashes, {"missing_slash"}),
+    ("add_variable", add_missing_variables, {"missing_variable"}),
+    ("drop_dangling_role", drop_dangling_roles, {"dangling_role"}),
+    ("rename_duplicate", rename_duplicate_variables, {"duplicate_variable"}),
+    ("sanitize", penman_safe_minimal, set()),
+]
+
+
+def diagnose(amr_str: str):
+    """
+    Classify what is wrong with `amr_str`.
+
+    Returns:
+        tuple: (error types, score). The error types come from the PENMAN
+        decode error when decoding fails, otherwise from the decoded graph
+        (duplicate variables, roles without a target); an empty list means the
+        AMR is fine. `score` orders attempts: any decodable AMR beats an
+        undecodable one, and a decode error further into the text is progress.
+    """
+    try:
+        graph = penman.decode(amr_str)
+    except DecodeError as e:
+        errors = []
+        line = (e.text or "")[:e.offset or 0]
+        if amr_str.count('"') % 2:
+            errors.append("unterminated_string")
+        if e.message == "Unexpected end of input" or amr_str.count("(") != amr_str.count(")"):
+            errors.append("unbalanced_parens")
+        if re.search(rf'\(\s*{_SYMBOL}\s+$', line):
+            errors.append("missing_slash")
+        elif re.search(rf'/\s*{_SYMBOL}\s+$', line):
+            errors.append("multiword_concept")
+        elif re.search(r'\(\s*$', line):
+            errors.append("missing_variable")
+        return errors or ["unknown"], (0, 0, e.lineno or 0, e.offset or 0)
+    except Exception:
+        return ["unknown"], (0, 0, 0, 0)
+
+    errors = []
+    variables = Counter(source for source, _, _ in graph.instances())
+    if any(count > 1 for count in variables.values()):
+        errors.append("duplicate_variable")
+    if any(target is None for _, role, target in graph.triples if role != ":instance"):
+        errors.append("dangling_role")
+    return errors, (1, -len(errors), 0, 0)
+
+
+def repair_amr(amr_str: str, max_steps: int = 8):
+    """
+    Repair a model AMR without regenerating it.
+
+    Each step diagnoses the current string and tries the strategies targeting
+    its errors first, then the others, keeping the first one that makes
+    progress (see `diagnose`). Stops once nothing is wrong or no strategy helps.
+
+    Returns:
+        tuple: (re-encoded AMR, names of the strategies applied), or
+        (None, names) if the result still cannot be decoded.
+    """
+    applied = []
+    errors, score = diagnose(amr_str)
+    for _ in range(max_steps):
+        if not errors:
+            break
+        ranked = sorted(STRATEGIES, key=lambda strategy: not strategy[2] & set(errors))
+        for name, repair, _ in ranked:
+            candidate = repair(amr_str)
+            if candidate == amr_str:
+                continue
+            candidate_errors, candidate_score = diagnose(candidate)
+            if candidate_score > score:
+                amr_str, errors, score = candidate, candidate_errors, candidate_score
+                applied.append(name)
+                break
+        else:
+            break
+
+    if score[0] == 0:
+        return None, applied
+    return penman.encode(penman.decode(amr_str)), applied
+
+
+if __name__ == "__main__":
+    examples = [
+        '(n / nhà :mod (n / nhỏ))',
+        '(a / b :ARG0 :ARG1 (c / d))',
+        '(c / thành phố :name (n / name :op1 "Hà" :op2 "Nội"))',
+        '(c thành_phố :mod (đ / đẹp))',
+        '(t / tôi :ARG0-of (/ đi-01)',
+        '(a / b :op1 "x)',
+        '(a / b :ARG0 (c / d :ARG1 (e / f',
+        ')))',
+    ]
+    for example in examples:
+        amr_str, applied = repair_amr(example)
+        status = "[Success]" if amr_str is not None else "[Error]"
+        print(f"{status} {example!r} -> {' + '.join(applied) or 'no repair'}")
+        if amr_str is not None:
+            print(amr_str)
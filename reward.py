@@ -1,16 +1,99 @@
 import re
+import atexit
+import multiprocessing
+import signal
+import time
 import smatch
 
 from .postprocessing import *
+from .amr_cache import SmatchCache
+from . import smatch_fast
+
+# Persistent worker pool for combined_reward (see configure_reward_pool)
+_pool = None
+_pool_config = {"num_workers": 0, "timeout": 10.0}
+# Smatch cache lookups across all calls, counted here because workers keep their own caches
+_reward_stats = {"smatch_lookups": 0, "smatch_hits": 0}
+
+# "reference" is the `smatch` package, "fast" is smatch_fast (see configure_smatch_engine)
+_smatch_engine_config = {"engine": "reference", "restarts": 4, "seed": 0}
 
 def get_amr_match(amr1, amr2):
+    if _smatch_engine_config["engine"] == "fast":
+        return smatch_fast.get_amr_match(amr1, amr2, restarts=_smatch_engine_config["restarts"],
+                                         seed=_smatch_engine_config["seed"])
     vals = smatch.get_amr_match(amr1, amr2)
     smatch.match_triple_dict.clear()
     return vals
 
-def compute_smatch_f1(gold_str, pred_str):
+
+def _engine_namespace():
+    # Keys of the reference engine are unchanged, so existing cache files stay valid
+    if _smatch_engine_config["engine"] == "reference":
+        return ""
+    return "{engine}:{restarts}:{seed}".format(**_smatch_engine_config)
+
+
+def configure_smatch_engine(engine="reference", restarts=4, seed=0):
+    """
+    Choose the smatch implementation: "reference" (the `smatch` package) or
+    "fast" (smatch_fast: NumPy hill-climbing, gold graphs parsed once, seeded
+    random restarts so equal inputs always score the same).
+    """
+    if engine not in ("reference", "fast"):
+        raise ValueError(f"Unknown smatch engine: {engine}")
+    _smatch_engine_config.update(engine=engine, restarts=restarts, seed=seed)
+    if _smatch_cache is not None:
+        _smatch_cache.namespace = _engine_namespace()
+
+# Memoizes compute_smatch_f1 (see configure_smatch_cache); None disables it
+_smatch_cache = SmatchCache()
+_smatch_cache_config = {"max_entries": 100000, "path": None}
+
+
+def configure_smatch_cache(max_entries=100000, path=None):
+    """Size the smatch LRU cache (0 disables it) and optionally persist it to a SQLite file."""
+    global _smatch_cache
+    _smatch_cache_config.update(max_entries=max_entries, path=path)
+    _smatch_cache = SmatchCache(max_entries, path, namespace=_engine_namespace()) if max_entries > 0 else None
+
+
+def smatch_cache_stats():
+    return _smatch_cache.stats() if _smatch_cache is not None else None
+
+
+def flush_smatch_cache():
+    """Commit smatch results still pending for the SQLite file (workers also commit every few seconds)."""
+    if _smatch_cache is not None:
+        _smatch_cache.flush()
+
+
+def compute_smatch_f1(gold_str, pred_str, gold_variables=None, gold_triples=None, gold_hash=None):
+    """
+    Smatch (f1, precision, recall) of `pred_str` against `gold_str`. The gold
+    graph's precomputed variables/triples (see data_loader.gold_structures)
+    replace parsing `gold_str` under the fast engine (built once per hash,
+    see smatch_fast.gold_graph), and its hash replaces the string in the
+    cache key.
+    """
+    gold_key = gold_hash or gold_str
+    if _smatch_cache is not None:
+        cached = _smatch_cache.get(gold_key, pred_str)
+        if cached is not None:
+            return cached
+    gold = gold_str
+    if gold_triples and _smatch_engine_config["engine"] == "fast":
+        gold = smatch_fast.gold_graph(gold_key, gold_variables, gold_triples)
+    result = _compute_smatch_f1(gold, pred_str)
+    if _smatch_cache is not None:
+        _smatch_cache.put(gold_key, pred_str, result)
+    return result
+
+
+def _compute_smatch_f1(gold_str, pred_str):
     try:
-        M, T, G = get_amr_match(gold_str, pred_str)
+        # smatch's order is (test, gold): precision is over the prediction's triples
+        M, T, G = get_amr_match(pred_str, gold_str)
         precision = M / T if T else 0
         recall = M / G if G else 0
         f1 = 2 * precision * recall / (precision + recall) if (precision + recall) > 0 else 0.0
@@ -26,72 +109,153 @@ def extract_answer(text: str) -> str | None:
 def check_valid_format(text: str) -> bool:
     return bool(text and re.search(r"<answer>.*?</answer>", text.strip(), flags=re.DOTALL))
 
-def check_balanced_parens(s: str) -> bool:
-    """Kiểm tra đóng mở dấu ngoặc tròn."""
-    stack = 0
-    for ch in s:
-        if ch == '(':
-            stack += 1
-        elif ch == ')':
-            stack -= 1
-            if stack < 0:
-                return False
-    return stack == 0
-
-def check_unique_vars(amr_str: str) -> bool:
-    """Kiểm tra biến không trùng (x1, x2, ...)."""
-    vars_found = re.findall(r"\((\w+)\s*/", amr_str)
-    return len(vars_found) == len(set(vars_found))
-
-def check_var_word_conflict(amr_str: str) -> bool:
+def score_completion(response_text: str, gold: str, gold_structures=None):
     """
-    Trả về True nếu TẤT CẢ biến và từ đều có ký tự đầu giống nhau (ví dụ: b1 / bi_kịch).
-    Nếu có ít nhất 1 cặp không trùng -> trả về False.
+    Score one completion against its gold AMR; returns the reward components
+    and their total. `gold_structures` is the gold's precomputed
+    (variables, triples, hash), if the dataset has them.
     """
-    matches = re.findall(r"\((\w+)\s*/\s*([^\s)]+)", amr_str)
-    if not matches:
-        return False 
-    
-    for var, word in matches:
-        if not word or var[0].lower() != word[0].lower():
-            return False
-    return True
+    # Extract & postprocess prediction
+    try:
+        pred_answer = penman_safe_minimal(extract_answer(response_text))
+    except Exception:
+        pred_answer = ''
 
-def combined_reward(prompts, completions, answers, **kwargs) -> list[float]:
-    scores = []
-    for completion, gold in zip(completions, answers):
-        response_text = completion[0]['content'].strip()
+    gold_answer = extract_answer(gold) or gold.strip()
 
-        # Extract & postprocess prediction
-        try:
-            pred_answer = extract_answer(response_text)
-            pred_answer = dedup_and_tidy(pred_answer, None)
-            pred_answer = fix_amr_vars(pred_answer)
-            pred_answer = balance_parens(pred_answer)
-            pred_answer = process_amr_general(pred_answer)
-        except Exception:
-            pred_answer = ''
+    scores = {
+        "format": 0.1 if check_valid_format(response_text) else 0.0,
+        "parens": 0.1 if pred_answer and check_balanced_parens(pred_answer) else 0.0,
+        "unique_vars": 0.1 if pred_answer and check_unique_vars(pred_answer) else 0.0,
+        "var_word": 0.1 if pred_answer and check_var_word_conflict(pred_answer) else 0.0,
+        "smatch_f1": 0.0,
+    }
+    if pred_answer:
+        hits = _smatch_cache.hits if _smatch_cache is not None else 0
+        scores["smatch_f1"], _, _ = compute_smatch_f1(gold_answer, pred_answer, *(gold_structures or ()))
+        scores["smatch_cached"] = _smatch_cache is not None and _smatch_cache.hits > hits
+    total_score = scores["format"] + scores["parens"] + scores["unique_vars"] + scores["var_word"] + 0.6 * scores["smatch_f1"]
+    scores["total"] = min(total_score, 1.0)
+    return scores
 
-        gold_answer = extract_answer(gold) or gold.strip()
 
-        format_score = 0.1 if check_valid_format(response_text) else 0.0
-        paren_score = 0.1 if pred_answer and check_balanced_parens(pred_answer) else 0.0
-        unique_var_score = 0.1 if pred_answer and check_unique_vars(pred_answer) else 0.0
-        var_word_conflict_score = 0.1 if pred_answer and check_var_word_conflict(pred_answer) else 0.0
+class RewardTimeout(BaseException):
+    """Raised inside a reward worker when one item runs past its timeout (not caught by `except Exception`)."""
 
-        smatch_f1 = 0
-        if pred_answer:
-            smatch_f1, _, _ = compute_smatch_f1(gold_answer, pred_answer)
-        smatch_score = 0.6 * smatch_f1
 
-        total_score = format_score + paren_score + unique_var_score + var_word_conflict_score + smatch_score
-        total_score = min(total_score, 1.0) 
+def _raise_timeout(signum, frame):
+    raise RewardTimeout()
 
-        scores.append(total_score)
 
-        print(f"Format: {format_score:.2f}, Parens: {paren_score:.2f}, Unique vars: {unique_var_score:.2f}, "
-              f"No var-word conflict: {var_word_conflict_score:.2f}, Smatch: {smatch_f1:.4f} ({smatch_score:.2f}), Total: {total_score:.4f}")
+def _init_reward_worker(cache_config, engine_config):
+    signal.signal(signal.SIGALRM, _raise_timeout)
+    configure_smatch_engine(**engine_config)
+    configure_smatch_cache(**cache_config)
+
+
+def _score_with_timeout(response_text, gold, gold_structures, timeout):
+    signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        return score_completion(response_text, gold, gold_structures)
+    except RewardTimeout:
+        # Hill-climbing was interrupted mid-way; drop its half-built state
+        smatch.match_triple_dict.clear()
+        return None
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+
+
+def configure_reward_pool(num_workers: int, timeout: float = 10.0):
+    """
+    Score completions in `num_workers` persistent processes (0 scores inline).
+    Each process has its own copy of smatch's global state. An item running
+    longer than `timeout` seconds scores 0 instead of stalling the step.
+    """
+    close_reward_pool()
+    _pool_config.update(num_workers=num_workers, timeout=timeout)
+
+
+def close_reward_pool():
+    global _pool
+    if _pool is not None:
+        _pool.terminate()
+        _pool.join()
+        _pool = None
+
+
+def _get_pool():
+    global _pool
+    if _pool is None and _pool_config["num_workers"] > 0:
+        # spawn: workers must not inherit the trainer's CUDA/NCCL state
+        context = multiprocessing.get_context("spawn")
+        _pool = context.Pool(_pool_config["num_workers"], initializer=_init_reward_worker,
+                             initargs=(dict(_smatch_cache_config), dict(_smatch_engine_config)))
+    return _pool
+
+
+atexit.register(close_reward_pool)
+atexit.register(flush_smatch_cache)
+
+
+def score_completions(responses, golds, gold_structures=None):
+    """
+    Score (response, gold) pairs, in the process pool when configured; keeps
+    the input order. `gold_structures` optionally holds one precomputed
+    (variables, triples, hash) per gold.
+    """
+    if gold_structures is None:
+        gold_structures = [None] * len(golds)
+    pool = _get_pool()
+    if pool is None:
+        results = [score_completion(response, gold, structures)
+                   for response, gold, structures in zip(responses, golds, gold_structures)]
+        # One commit per reward batch instead of one per item
+        flush_smatch_cache()
+        return results
+
+    timeout = _pool_config["timeout"]
+    pending = [pool.apply_async(_score_with_timeout, (response, gold, structures, timeout))
+               for response, gold, structures in zip(responses, golds, gold_structures)]
+    # Backstop in case a worker cannot be interrupted: every item gets its turn plus its timeout
+    deadline = time.time() + timeout * (len(pending) / _pool_config["num_workers"] + 1) + 5
+    results = []
+    stalled = False
+    for result in pending:
+        try:
+            results.append(result.get(timeout=max(0.0, deadline - time.time())))
+        except multiprocessing.TimeoutError:
+            stalled = True
+            results.append(None)
+    if stalled:
+        print("[Warning] Reward workers stalled past the deadline; restarting the pool")
+        close_reward_pool()
+    return results
+
+
+def combined_reward(prompts, completions, answers, **kwargs) -> list[float]:
+    responses = [completion[0]['content'].strip() for completion in completions]
+    # TRL passes the other dataset columns as keyword lists; GRPO datasets carry the parsed gold graphs
+    gold_structures = None
+    if kwargs.get("gold_triples") is not None:
+        gold_structures = list(zip(kwargs["gold_variables"], kwargs["gold_triples"], kwargs["gold_hash"]))
+    scores = []
+    for result in score_completions(responses, answers, gold_structures):
+        if result is None:
+            print(f"[Warning] Reward timed out after {_pool_config['timeout']}s, scoring 0")
+            scores.append(0.0)
+            continue
+        scores.append(result["total"])
+        if "smatch_cached" in result:
+            _reward_stats["smatch_lookups"] += 1
+            _reward_stats["smatch_hits"] += result["smatch_cached"]
+
+        print(f"Format: {result['format']:.2f}, Parens: {result['parens']:.2f}, Unique vars: {result['unique_vars']:.2f}, "
+              f"No var-word conflict: {result['var_word']:.2f}, Smatch: {result['smatch_f1']:.4f} ({0.6 * result['smatch_f1']:.2f}), "
+              f"Total: {result['total']:.4f}")
 
+    if _smatch_cache is not None and _reward_stats["smatch_lookups"]:
+        print(f"Smatch cache: {_reward_stats['smatch_hits']}/{_reward_stats['smatch_lookups']} hits "
+              f"({_reward_stats['smatch_hits'] / _reward_stats['smatch_lookups']:.1%})")
     return scores
 if __name__ == "__main__":
     gold_str = "<answer>(x1 / bi_kịch :domain (x2 / chỗ :mod (x3 / đó)))</answer>"
@@ -0,0 +1,9 @@
+export PYTHONPATH="//home/fit02/dien-workspace/viamr/src:$PYTHONPATH"
+echo "Running backend benchmark..."
+
+python3 -m src.bench_backend \
+    --model_name "/home/fit02/dien-workspace/viamr/outputs/Qwen-1.7B-SFT-2" \
+    --gold_file "/home/fit02/dien-workspace/viamr/src/data/test.txt" \
+    --backends "hf,hf-cpu-int8" \
+    --num_samples 50 \
+    --batch_size 4
@@ -0,0 +1,11 @@
+export PYTHONPATH="/home/fit02/dien-workspace/viamr/src:$PYTHONPATH"
+echo "Profiling token lengths..."
+
+python3 -m src.profile_lengths \
+    --dataset1_path "/home/fit02/dien-workspace/viamr/src/data/train_amr_1.txt" \
+    --dataset2_path "/home/fit02/dien-workspace/viamr/src/data/train_amr_2.txt" \
+    --dataset_cache_dir "/home/fit02/dien-workspace/viamr/cache/datasets" \
+    --model_name "Qwen/Qwen3-1.7B" \
+    --memory_gb 80 \
+    --num_gpus 2 \
+    --num_proc 8
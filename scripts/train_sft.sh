@@ -12,6 +12,7 @@ export CUDA_VISIBLE_DEVICES=0,1
 torchrun --nproc_per_node=2 -m src.train_sft \
     --dataset1_path "/home/fit02/dien-workspace/viamr/src/data/train_amr_1.txt" \
     --dataset2_path "/home/fit02/dien-workspace/viamr/src/data/train_amr_2.txt" \
+    --dataset_cache_dir "/home/fit02/dien-workspace/viamr/cache/datasets" \
     --output_dir "/home/fit02/dien-workspace/viamr/outputs/Qwen-1.7B-SFT-2" \
     --model_name "Qwen/Qwen3-1.7B" \
     --deepspeed_path "/home/fit02/dien-workspace/viamr/src/config/ds_zero2.json" \
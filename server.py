@@ -0,0 +1,227 @@
+import argparse
+import asyncio
+import json
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from .main import normalize_sentence, decode_or_repair, finalize_amr
+
+
+class MockReasoner:
+    """
+    CPU stand-in for QwenReasoner used to load-test the server: each
+    `inference_batch` call sleeps like a generate call and returns a small AMR.
+    """
+
+    def __init__(self, latency=0.5, per_item_latency=0.01):
+        self.latency = latency
+        self.per_item_latency = per_item_latency
+
+    def inference_batch(self, prompts, batch_size=8, **kwargs):
+        time.sleep(self.latency + self.per_item_latency * len(prompts))
+        return [(None, f"(s / sentence :quant {len(prompt.split())})") for prompt in prompts]
+
+
+class MicroBatcher:
+    """
+    Collect concurrent requests into batched `inference_batch` calls.
+
+    A batch is dispatched once it holds `max_batch_size` sentences or the first
+    sentence has waited `max_wait_ms`. Up to `concurrency` batches run at the
+    same time in worker threads, so a new request does not have to wait for a
+    long generation to finish. All workers share one `model`, so `concurrency`
+    above 1 is only safe with a thread-safe backend such as MockReasoner:
+    QwenReasoner keeps per-call stats and assisted/prefix-cache state that
+    concurrent `inference_batch` calls would corrupt. The queue is bounded
+    (`max_queue_size`) for backpressure, and each request gives up after
+    `request_timeout` seconds.
+    """
+
+    def __init__(self, model, max_batch_size=8, max_wait_ms=20, max_queue_size=256,
+                 request_timeout=600.0, concurrency=1, constrained=False):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self.request_timeout = request_timeout
+        self.concurrency = concurrency
+        self.constrained = constrained
+        self.queue = asyncio.Queue(maxsize=max_queue_size)
+        self.executor = ThreadPoolExecutor(max_workers=concurrency)
+        self.batches = 0
+        self.batched_requests = 0
+        self.rejected = 0
+        self.timeouts = 0
+        self.repairs = Counter()
+
+    def start(self):
+        return [asyncio.create_task(self.run()) for _ in range(self.concurrency)]
+
+    async def submit(self, sentence):
+        """Queue one sentence and wait for its AMR. Raises asyncio.QueueFull or asyncio.TimeoutError."""
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait((sentence, future))
+        except asyncio.QueueFull:
+            self.rejected += 1
+            raise
+        try:
+            return await asyncio.wait_for(future, self.request_timeout)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+            raise
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            # Skip requests whose caller already timed out
+            batch = [(sentence, future) for sentence, future in batch if not future.done()]
+            if not batch:
+                continue
+
+            self.batches += 1
+            self.batched_requests += len(batch)
+            try:
+                results = await loop.run_in_executor(self.executor, self.parse, [sentence for sentence, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), amr_str in zip(batch, results):
+                if not future.done():
+                    future.set_result(amr_str)
+
+    def parse(self, sentences):
+        outputs = self.model.inference_batch(
+            [normalize_sentence(sentence) for sentence in sentences],
+            batch_size=len(sentences),
+            is_extract_amr=True,
+            is_thinking=True,
+            constrained=self.constrained
+        )
+        results = []
+        for thinking, predict in outputs:
+            amr_str = decode_or_repair(predict, self.repairs)
+            results.append(finalize_amr(amr_str if amr_str is not None else "fail"))
+        return results
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "batches": self.batches,
+            "avg_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "repairs": dict(self.repairs),
+        }
+
+
+async def handle_connection(batcher, reader, writer):
+    status, payload = 200, {}
+    try:
+        request_line = (await reader.readline()).decode("latin-1").split()
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body = await reader.readexactly(int(headers.get("content-length", 0)))
+
+        method, path = request_line[0], request_line[1]
+        if method == "GET" and path == "/health":
+            payload = batcher.stats()
+        elif method == "POST" and path == "/parse":
+            sentence = json.loads(body)["sentence"]
+            payload = {"amr": await batcher.submit(sentence)}
+        else:
+            status, payload = 404, {"error": "not found"}
+    except asyncio.QueueFull:
+        status, payload = 503, {"error": "queue full"}
+    except asyncio.TimeoutError:
+        status, payload = 504, {"error": "request timed out"}
+    except (ValueError, KeyError, IndexError) as e:
+        status, payload = 400, {"error": f"bad request: {e}"}
+    except Exception as e:
+        status, payload = 500, {"error": str(e)}
+
+    data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+    reason = {200: "OK", 400: "Bad Request", 404: "Not Found", 500: "Internal Server Error",
+              503: "Service Unavailable", 504: "Gateway Timeout"}[status]
+    writer.write(
+        f"HTTP/1.1 {status} {reason}\r\nContent-Type: application/json\r\n"
+        f"Content-Length: {len(data)}\r\nConnection: close\r\n\r\n".encode("latin-1") + data
+    )
+    try:
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def serve(args):
+    if args.mock:
+        model = MockReasoner(latency=args.mock_latency)
+    else:
+        from .infer import QwenReasoner
+        model = QwenReasoner(model_name=args.model_name, use_prefix_cache=args.prefix_cache)
+        if args.concurrency > 1:
+            # QwenReasoner state is not thread-safe, so only one batch may generate at a time
+            print(f"[Warning] --concurrency {args.concurrency} is only supported with --mock; using 1")
+            args.concurrency = 1
+
+    batcher = MicroBatcher(
+        model,
+        max_batch_size=args.max_batch_size,
+        max_wait_ms=args.max_wait_ms,
+        max_queue_size=args.max_queue_size,
+        request_timeout=args.request_timeout,
+        concurrency=args.concurrency,
+        constrained=bool(args.constrained)
+    )
+    workers = batcher.start()
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(batcher, reader, writer),
+        args.host, args.port
+    )
+    print(f"Serving on http://{args.host}:{args.port} (POST /parse, GET /health)")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        # Stop the batch workers before the executor they submit generate calls to
+        for worker in workers:
+            worker.cancel()
+        await asyncio.gather(*workers, return_exceptions=True)
+        batcher.executor.shutdown(wait=False, cancel_futures=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve AMR parsing over HTTP with micro-batching.")
+    parser.add_argument("--model_name", type=str, default="Qwen-7B")
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--max_batch_size", type=int, default=8, help="Maximum sentences per generate call")
+    parser.add_argument("--max_wait_ms", type=float, default=20, help="Maximum time a request waits for its batch to fill")
+    parser.add_argument("--max_queue_size", type=int, default=256, help="Requests beyond this are rejected with 503")
+    parser.add_argument("--request_timeout", type=float, default=600, help="Per-request timeout in seconds")
+    parser.add_argument("--concurrency", type=int, default=1, help="Number of batches generated at the same time (values above 1 only with --mock)")
+    parser.add_argument("--constrained", type=int, default=0, help="Use PENMAN grammar-constrained decoding inside <answer>")
+    parser.add_argument("--prefix_cache", type=int, default=0, help="Reuse the KV cache of the shared system-prompt prefix")
+    parser.add_argument("--mock", type=int, default=0, help="Use a mock CPU backend for load testing")
+    parser.add_argument("--mock_latency", type=float, default=0.5, help="Seconds per mock generate call")
+
+    args = parser.parse_args()
+    asyncio.run(serve(args))
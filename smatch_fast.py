@@ -0,0 +1,304 @@
+import hashlib
+import json
+import random
+from collections import OrderedDict, defaultdict
+from functools import lru_cache
+
+import numpy as np
+import amr as smatch_amr
+
+
+def normalize(item):
+    """Same comparison key as smatch: lowercase, without the trailing `_` left by quotes."""
+    return item.lower().rstrip('_')
+
+
+def amr_triples(amr_str):
+    """
+    Parse `amr_str` with smatch's own parser, so the triples follow its
+    conventions: a TOP attribute on the root, `:X-of` and `:mod` stored
+    inverted, quotes stripped from constants.
+
+    Returns:
+        tuple: (variables, triples) with triples as (relation, source variable,
+        target) lists; ("instance", v, concept) for concepts, and attributes
+        whose target is not a variable. JSON-serializable.
+    """
+    graph = smatch_amr.AMR.parse_AMR_line(amr_str.strip())
+    if graph is None:
+        raise ValueError(f"Cannot parse AMR: {amr_str}")
+    triples = []
+    for i, variable in enumerate(graph.nodes):
+        triples.append(["instance", variable, graph.node_values[i]])
+        for relation, target in graph.relations[i]:
+            triples.append([relation, variable, target])
+        for name, value in graph.attributes[i]:
+            # smatch wraps the names of quoted constants in a list
+            triples.append([name[0] if isinstance(name, list) else name, variable, value])
+    return list(graph.nodes), triples
+
+
+def triples_hash(variables, triples):
+    """Hash of a parsed graph, independent of how its PENMAN string was laid out."""
+    payload = json.dumps([variables, triples], ensure_ascii=False, separators=(",", ":"))
+    return hashlib.blake2b(payload.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class AMRTriples:
+    """Instance, attribute and relation triples of one AMR, indexed by node for matching."""
+
+    def __init__(self, variables, triples):
+        index = {variable: i for i, variable in enumerate(variables)}
+        self.concepts = [None] * len(variables)
+        # normalized (name, value) -> node indices / normalized relation -> (source, target) indices
+        self.attributes = defaultdict(list)
+        relations = defaultdict(list)
+        for relation, source, target in triples:
+            if relation == "instance":
+                self.concepts[index[source]] = normalize(target)
+            elif target in index:
+                relations[normalize(relation)].append((index[source], index[target]))
+            else:
+                self.attributes[(normalize(relation), normalize(target))].append(index[source])
+        self.relations = {name: np.array(pairs, dtype=np.int64) for name, pairs in relations.items()}
+        self.num_nodes = len(variables)
+        self.num_triples = len(triples)
+
+    @classmethod
+    def parse(cls, amr_str):
+        return cls(*amr_triples(amr_str))
+
+
+@lru_cache(maxsize=65536)
+def parse_amr(amr_str):
+    """Cached `AMRTriples.parse`; gold graphs are parsed once however often they are scored."""
+    return AMRTriples.parse(amr_str)
+
+
+_gold_graphs = OrderedDict()
+_GOLD_GRAPHS_MAXSIZE = 65536
+
+
+def gold_graph(gold_hash, variables, triples):
+    """
+    `AMRTriples` of a gold graph's precomputed variables/triples, memoized on
+    its `triples_hash` like `parse_amr` memoizes on the string.
+    """
+    graph = _gold_graphs.get(gold_hash)
+    if graph is not None:
+        _gold_graphs.move_to_end(gold_hash)
+        return graph
+    graph = AMRTriples(variables, triples)
+    _gold_graphs[gold_hash] = graph
+    if len(_gold_graphs) > _GOLD_GRAPHS_MAXSIZE:
+        _gold_graphs.popitem(last=False)
+    return graph
+
+
+class _Problem:
+    """
+    Node-mapping objective between a test and a gold AMR: `unary[i, j]` triples
+    matched by mapping test node i to gold node j alone (instances, attributes,
+    self-loops) and relation edges matched when two mappings hold together.
+    Column `n2` of `unary` stands for "unmapped".
+    """
+
+    def __init__(self, test, gold):
+        n1, n2 = test.num_nodes, gold.num_nodes
+        self.n1, self.n2 = n1, n2
+        unary = np.zeros((n1, n2 + 1), dtype=np.int64)
+        vocab = {}
+        gold_concepts = np.array([vocab.setdefault(c, len(vocab)) for c in gold.concepts], dtype=np.int64)
+        test_concepts = np.array([vocab.get(c, -1) for c in test.concepts], dtype=np.int64)
+        self.concept_match = test_concepts[:, None] == gold_concepts[None, :]
+        unary[:, :n2] += self.concept_match
+        for key, nodes in test.attributes.items():
+            for i in nodes:
+                for j in gold.attributes.get(key, ()):
+                    unary[i, j] += 1
+
+        sources, targets = [], []
+        for name, pairs in test.relations.items():
+            gold_pairs = gold.relations.get(name)
+            if gold_pairs is None:
+                continue
+            # every test edge against every gold edge with the same relation
+            sources.append(np.repeat(pairs, len(gold_pairs), axis=0))
+            targets.append(np.tile(gold_pairs, (len(pairs), 1)))
+        if sources:
+            a, b = np.concatenate(sources), np.concatenate(targets)
+            i1, i2, j1, j2 = a[:, 0], a[:, 1], b[:, 0], b[:, 1]
+        else:
+            i1 = i2 = j1 = j2 = np.zeros(0, dtype=np.int64)
+        self_loop = (i1 == i2) & (j1 == j2)
+        np.add.at(unary, (i1[self_loop], j1[self_loop]), 1)
+        # Pairs that map one node twice or two nodes to one can never both hold
+        keep = (i1 != i2) & (j1 != j2)
+        i1, i2, j1, j2 = i1[keep], i2[keep], j1[keep], j2[keep]
+        self.unary = unary
+
+        self.candidates = unary[:, :n2] > 0
+        self.candidates[i1, j1] = True
+        self.candidates[i2, j2] = True
+        # Plain lists: initial mappings are built node by node
+        self.candidate_lists = [np.flatnonzero(row).tolist() for row in self.candidates]
+        self.concept_lists = [np.flatnonzero(row).tolist() for row in self.candidates & self.concept_match]
+
+        # Edges with i1 < i2 for swap corrections; both directions for the support matrix
+        flip = i1 > i2
+        self.e_i1, self.e_i2 = np.where(flip, i2, i1), np.where(flip, i1, i2)
+        self.e_j1, self.e_j2 = np.where(flip, j2, j1), np.where(flip, j1, j2)
+        self.d_i1 = np.concatenate([self.e_i1, self.e_i2])
+        self.d_j1 = np.concatenate([self.e_j1, self.e_j2])
+        self.d_i2 = np.concatenate([self.e_i2, self.e_i1])
+        self.d_j2 = np.concatenate([self.e_j2, self.e_j1])
+        self.by_partner = [np.flatnonzero(self.d_i2 == i) for i in range(n1)]
+
+    def support(self, mapping):
+        """support[i, j]: relation triples gained by mapping i -> j given the other nodes' current mapping."""
+        support = np.zeros((self.n1, self.n2 + 1), dtype=np.int64)
+        active = mapping[self.d_i2] == self.d_j2
+        np.add.at(support, (self.d_i1[active], self.d_j1[active]), 1)
+        return support
+
+    def update_support(self, support, node, old, new):
+        edges = self.by_partner[node]
+        j2 = self.d_j2[edges]
+        lost, gained = edges[j2 == old], edges[j2 == new]
+        np.subtract.at(support, (self.d_i1[lost], self.d_j1[lost]), 1)
+        np.add.at(support, (self.d_i1[gained], self.d_j1[gained]), 1)
+
+    def score(self, mapping, support):
+        rows = np.arange(self.n1)
+        return int(self.unary[rows, mapping].sum() + support[rows, mapping].sum() // 2)
+
+    def smart_init(self, rng):
+        """Map nodes to the first free gold node with the same concept, the rest randomly (as smatch)."""
+        mapping = [self.n2] * self.n1
+        taken = set()
+        pending = []
+        for i, concepts in enumerate(self.concept_lists):
+            free = [j for j in concepts if j not in taken]
+            if free:
+                mapping[i] = free[0]
+                taken.add(free[0])
+            else:
+                pending.append(i)
+        for i in pending:
+            free = [j for j in self.candidate_lists[i] if j not in taken]
+            if free:
+                mapping[i] = rng.choice(free)
+                taken.add(mapping[i])
+        return np.array(mapping, dtype=np.int64)
+
+    def random_init(self, rng):
+        mapping = [self.n2] * self.n1
+        taken = set()
+        for i, candidates in enumerate(self.candidate_lists):
+            free = [j for j in candidates if j not in taken]
+            if free:
+                mapping[i] = rng.choice(free)
+                taken.add(mapping[i])
+        return np.array(mapping, dtype=np.int64)
+
+    def climb(self, mapping):
+        """Steepest-ascent hill-climbing over moves and swaps; returns (mapping, match count)."""
+        support = self.support(mapping)
+        score = self.score(mapping, support)
+        rows = np.arange(self.n1)
+        upper = np.triu(np.ones((self.n1, self.n1), dtype=bool), k=1)
+        while True:
+            gain = self.unary + support
+            current = gain[rows, mapping]
+
+            # Move: remap i to a free candidate gold node
+            taken = np.zeros(self.n2 + 1, dtype=bool)
+            taken[mapping] = True
+            move = gain[:, :self.n2] - current[:, None]
+            move[~self.candidates | taken[None, :self.n2]] = -1
+
+            # Swap the gold nodes of i < k; the correction handles edges between i and k themselves
+            exchanged = gain[:, mapping]
+            swap = exchanged + exchanged.T - current[:, None] - current[None, :]
+            a, b = mapping[self.e_i1], mapping[self.e_i2]
+            correction = ((self.e_j1 == a) & (self.e_j2 == b)).astype(np.int64) \
+                + ((self.e_j1 == b) & (self.e_j2 == a)) \
+                - ((self.e_j1 == b) & (self.e_j2 == b)) \
+                - ((self.e_j1 == a) & (self.e_j2 == a))
+            np.add.at(swap, (self.e_i1, self.e_i2), correction)
+            swap[~upper] = -1
+
+            best_move = move.argmax() if move.size else 0
+            best_swap = swap.argmax() if swap.size else 0
+            move_gain = move.flat[best_move] if move.size else -1
+            swap_gain = swap.flat[best_swap] if swap.size else -1
+            if max(move_gain, swap_gain) <= 0:
+                return mapping, score
+            if move_gain >= swap_gain:
+                i, j = divmod(int(best_move), self.n2)
+                old = mapping[i]
+                mapping[i] = j
+                self.update_support(support, i, old, j)
+                score += int(move_gain)
+            else:
+                i, k = divmod(int(best_swap), self.n1)
+                mi, mk = mapping[i], mapping[k]
+                mapping[i], mapping[k] = mk, mi
+                self.update_support(support, i, mi, mk)
+                self.update_support(support, k, mk, mi)
+                score += int(swap_gain)
+
+
+def smatch_match(test, gold, restarts=4, seed=0):
+    """
+    Best number of matching triples between two `AMRTriples`, like
+    `smatch.get_amr_match`: one smart and `restarts` random starting mappings,
+    each improved by hill-climbing. `seed` makes the random starts repeatable.
+
+    Returns:
+        tuple: (matching triples, test triples, gold triples)
+    """
+    if not test.num_nodes or not gold.num_nodes:
+        return 0, test.num_triples, gold.num_triples
+    problem = _Problem(test, gold)
+    rng = random.Random(seed)
+    # No mapping can match more triples than the smaller graph has
+    bound = min(test.num_triples, gold.num_triples)
+    best = 0
+    for attempt in range(restarts + 1):
+        mapping = problem.smart_init(rng) if attempt == 0 else problem.random_init(rng)
+        _, score = problem.climb(mapping)
+        best = max(best, score)
+        if best >= bound:
+            break
+    return best, test.num_triples, gold.num_triples
+
+
+def get_amr_match(amr1, amr2, restarts=4, seed=0):
+    """
+    Drop-in for `smatch.get_amr_match` with `amr1` the test graph and `amr2`
+    the gold. Either side may be pre-parsed `AMRTriples`. Only the gold goes
+    through the `parse_amr` cache; test graphs are mostly one-off predictions
+    and would just evict the golds.
+    """
+    test = amr1 if isinstance(amr1, AMRTriples) else AMRTriples.parse(amr1)
+    gold = amr2 if isinstance(amr2, AMRTriples) else parse_amr(amr2)
+    return smatch_match(test, gold, restarts=restarts, seed=seed)
+
+
+if __name__ == "__main__":
+    import smatch
+
+    pairs = [
+        ("(x1 / bi_kịch :domain (x2 / chỗ :mod (x3 / đó)))", "(x1 / bi_kịch :domain (x2 / chỗ :mod (x3 / đó)))"),
+        ("(c / có :ARG0 (t / tôi) :ARG1 (n / nhà))", "(c / có :ARG0 (t / tôi) :ARG1 (n / nhà :mod (đ / đẹp)))"),
+        ("(a / ăn-01 :ARG0 (b / bé) :ARG1 (c / cơm) :time (s / sáng))", "(e / ăn-01 :ARG1 (r / cơm) :ARG0 (k / bé))"),
+        ('(c / city :name (n / name :op1 "Hà" :op2 "Nội"))', '(t / thành_phố :name (n / name :op1 "Hà" :op2 "Nội"))'),
+        ("(b / bé :ARG0-of (a / ăn-01 :polarity -))", "(a / ăn-01 :ARG0 (b / bé) :polarity -)"),
+    ]
+    for amr1, amr2 in pairs:
+        reference = smatch.get_amr_match(amr1, amr2)
+        smatch.match_triple_dict.clear()
+        fast = get_amr_match(amr1, amr2)
+        status = "[Success]" if fast == reference else "[Warning]"
+        print(f"{status} fast {fast} reference {reference}")
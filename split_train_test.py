@@ -1,11 +1,10 @@
 import random
 
+from .data_processing import iter_amr_blocks
+
 def read_amr_blocks(file_path):
     """Read AMR file into a list of blocks"""
-    with open(file_path, 'r', encoding='utf-8') as f:
-        content = f.read().strip()
-    blocks = content.split("\n\n")
-    return [b.strip() for b in blocks if b.strip()]
+    return [f"#::snt {sent}\n{amr}" for sent, amr in iter_amr_blocks(file_path)]
 
 def split_blocks(blocks, test_ratio=0.2):
     """Split into train/test sets"""
@@ -0,0 +1,32 @@
+import sqlite3
+
+from src.amr_cache import SmatchCache
+
+
+def rows(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT COUNT(*) FROM smatch_cache").fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_smatch_cache_commits_in_batches_and_evicts_in_bulk(tmp_path):
+    path = str(tmp_path / "smatch.sqlite")
+    cache = SmatchCache(max_entries=5, path=path, commit_every=4, commit_interval=3600)
+    for i in range(3):
+        cache.put(f"(a{i} / b)", "(a / b)", (1.0, 1.0, 1.0))
+    # Still pending: another connection sees nothing, this one sees its own writes
+    assert rows(path) == 0
+    assert cache.get("(a0 / b)", "(a / b)") == (1.0, 1.0, 1.0)
+    cache.put("(a3 / b)", "(a / b)", (0.5, 0.5, 0.5))
+    assert rows(path) == 4
+
+    for i in range(4, 8):
+        cache.put(f"(a{i} / b)", "(a / b)", (0.5, 0.5, 0.5))
+    assert rows(path) == 5
+    cache.flush()
+
+    reopened = SmatchCache(max_entries=5, path=path)
+    assert reopened.get("(a7 / b)", "(a / b)") == (0.5, 0.5, 0.5)
+    assert reopened.get("(a0 / b)", "(a / b)") is None
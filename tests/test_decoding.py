@@ -0,0 +1,88 @@
+import torch
+
+from src.decoding import AnswerStoppingCriteria, PenmanLogitsProcessor, PenmanPrefixValidator
+
+
+class CharTokenizer:
+    """Fake tokenizer: one token per character, plus a few multi-character tokens."""
+
+    def __init__(self, extra=()):
+        self.vocab = list("()/: abcxyz-<>answer_") + ["</answer>", "</think>", "<eos>"] + list(extra)
+        self.eos_token_id = self.vocab.index("<eos>")
+        self.think_end_id = self.vocab.index("</think>")
+        self.all_special_ids = [self.eos_token_id]
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def decode(self, ids, skip_special_tokens=False):
+        return "".join(self.vocab[i] for i in ids if not (skip_special_tokens and i in self.all_special_ids))
+
+    def batch_decode(self, rows, skip_special_tokens=False):
+        return [self.decode(ids, skip_special_tokens) for ids in rows]
+
+    def encode(self, text):
+        ids = []
+        while text:
+            token = max((t for t in self.vocab if text.startswith(t)), key=len)
+            ids.append(self.vocab.index(token))
+            text = text[len(token):]
+        return ids
+
+
+def allowed_tokens(processor, tokenizer, text):
+    input_ids = torch.tensor([tokenizer.encode(text)])
+    scores = processor(input_ids, torch.zeros(1, len(tokenizer)))
+    return {tokenizer.vocab[i] for i in torch.nonzero(scores[0] > float("-inf")).flatten().tolist()}
+
+
+def test_answer_in_thinking_does_not_stop():
+    tokenizer = CharTokenizer()
+    criteria = AnswerStoppingCriteria(tokenizer, prompt_length=0, think_end_id=tokenizer.think_end_id)
+    thinking = tokenizer.encode("<answer>(a / b)</answer>")
+    assert not criteria(torch.tensor([thinking]), None)[0]
+    answered = thinking + tokenizer.encode("</think><answer>(a / b)</answer>")
+    assert criteria(torch.tensor([answered]), None)[0]
+
+
+def test_validator_ignores_answer_in_thinking():
+    tokenizer = CharTokenizer()
+    validator = PenmanPrefixValidator(tokenizer, prompt_length=0, think_end_id=tokenizer.think_end_id)
+    ids = tokenizer.encode("<answer>(a / b))</think><answer>(a / b))")
+    for length in range(1, len(ids) + 1):
+        validator(torch.tensor([ids[:length]]), None)
+        if 0 in validator.aborted:
+            break
+    # Aborted on the second ')' of the real answer, not of the one in the thinking
+    assert validator.aborted[0][0] == len(ids) - 1
+
+
+def test_processor_constrains_the_answer_after_thinking():
+    tokenizer = CharTokenizer()
+    processor = PenmanLogitsProcessor(tokenizer, prompt_length=0, think_end_id=tokenizer.think_end_id)
+    # Inside the thinking an answer tag (even a closed one) leaves the row unconstrained
+    assert allowed_tokens(processor, tokenizer, "<answer>(a / b)</answer> (") == set(tokenizer.vocab)
+    assert ")" not in allowed_tokens(processor, tokenizer, "<answer>(a / b)</answer></think><answer>(")
+    assert allowed_tokens(processor, tokenizer, "<answer>(a / b)</answer></think><answer>(a / b)") >= {"</answer>", "<"}
+
+
+def test_processor_dead_end_forces_eos():
+    tokenizer = CharTokenizer()
+    processor = PenmanLogitsProcessor(tokenizer, prompt_length=0)
+    # The answer is already invalid: only ending the row is legal
+    assert allowed_tokens(processor, tokenizer, "<answer>(a / b))") == {"<eos>"}
+
+    # No token continues "(": the row still stays masked
+    tokenizer = CharTokenizer()
+    tokenizer.vocab = ["<answer>", "(", ")", "<eos>"]
+    tokenizer.eos_token_id, tokenizer.all_special_ids = 3, [3]
+    processor = PenmanLogitsProcessor(tokenizer, prompt_length=0)
+    assert allowed_tokens(processor, tokenizer, "<answer>(") == {"<eos>"}
+
+
+def test_processor_checks_the_token_completing_the_answer_tag():
+    tokenizer = CharTokenizer(extra=["answer>(", "answer>)"])
+    processor = PenmanLogitsProcessor(tokenizer, prompt_length=0)
+    allowed = allowed_tokens(processor, tokenizer, "<")
+    assert "answer>(" in allowed
+    assert "answer>)" not in allowed
@@ -0,0 +1,169 @@
+import json
+import os
+from collections import Counter
+from types import SimpleNamespace
+
+import penman
+
+from src.main import commit_record, decode_amr, decode_or_repair, finalize_amr, iter_records, load_progress, main, \
+    manifest_path, open_cache, parse_with_candidates, sort_output
+from src.repair import diagnose
+
+
+def run(output_file, items, torn=False):
+    """Resume `output_file` and commit `items`; with `torn`, die halfway through writing the last one."""
+    done = load_progress(output_file)
+    with open(output_file, "ab") as out_f, \
+            open(manifest_path(output_file), "a", encoding="utf-8") as manifest_f:
+        for idx in items:
+            if idx in done:
+                continue
+            if torn and idx == items[-1]:
+                out_f.write(f"#::snt {idx} câu {idx}\n(a / b".encode("utf-8"))
+                manifest_f.write('{"idx": %d, "off' % idx)
+                return
+            commit_record(out_f, manifest_f, idx, f"câu {idx}", f"(x{idx} / a)")
+
+
+def test_resume_twice_after_torn_manifest_line(tmp_path):
+    output_file = str(tmp_path / "out.txt")
+    run(output_file, [0, 1, 2, 3], torn=True)
+    run(output_file, [0, 1, 2, 3, 4], torn=True)
+    run(output_file, [0, 1, 2, 3, 4, 5])
+
+    assert load_progress(output_file) == {0, 1, 2, 3, 4, 5}
+    with open(output_file, "rb") as f:
+        records = [record[:3] for record in iter_records(f.read())]
+    assert records == [(idx, f"câu {idx}", f"(x{idx} / a)") for idx in range(6)]
+    with open(manifest_path(output_file), "rb") as f:
+        assert f.read().count(b"\n") == 6
+
+
+def test_repairs_graphs_that_decode_but_are_invalid():
+    repairs = Counter()
+    # penman.decode accepts both of these
+    duplicate = decode_or_repair("(n / nhà :mod (n / nhỏ))", repairs)
+    assert diagnose(duplicate)[0] == []
+    assert len(penman.decode(duplicate).instances()) == 2
+    dangling = decode_or_repair("(a / b :ARG0 :ARG1 (c / d))", repairs)
+    assert diagnose(dangling)[0] == []
+    assert repairs == Counter({"rename_duplicate": 1, "drop_dangling_role": 1})
+
+    # Valid graphs are returned as decoded and not counted; without `repairs` nothing is repaired
+    assert decode_or_repair("(a / b :ARG1 (c / d))", repairs) == decode_amr("(a / b :ARG1 (c / d))")
+    assert sum(repairs.values()) == 2
+    assert decode_or_repair("(n / nhà :mod (n / nhỏ))") == decode_amr("(n / nhà :mod (n / nhỏ))")
+
+
+def test_undecodable_candidates_finish_as_fail():
+    class Model:
+        def inference_candidates(self, prompt, num_candidates, **kwargs):
+            return [("", ")")] * num_candidates
+
+    args = SimpleNamespace(num_candidates=2, max_new_tokens=16, constrained=0)
+    amr_str, failures = parse_with_candidates(Model(), "câu", args, max_tries=4)
+    assert (amr_str, failures) == ("fail", 4)
+    # ")" sanitizes to "", which must never be committed as an empty record
+    assert finalize_amr(")") == "fail"
+    assert finalize_amr("(a / b") == decode_amr("(a / b)")
+
+
+def test_candidates_stay_within_the_retry_budget():
+    class FailingModel:
+        calls = []
+
+        def inference_candidates(self, prompt, num_candidates, **kwargs):
+            self.calls.append(num_candidates)
+            return [("", "(a / b")] * num_candidates
+
+    args = SimpleNamespace(num_candidates=4, max_new_tokens=16, constrained=0)
+    model = FailingModel()
+    _, failures = parse_with_candidates(model, "câu", args, max_tries=10)
+    assert failures == 10
+    assert model.calls == [4, 4, 2]
+
+
+def test_cache_key_depends_on_backend_and_retry_settings(tmp_path):
+    args = SimpleNamespace(
+        cache_path=str(tmp_path / "cache.sqlite"), cache_max_entries=100, model_name="model", backend="hf",
+        constrained=0, enable_thinking=1, max_thinking_tokens=0, max_new_tokens=2048,
+        validate_prefix=0, max_resamples=2, num_candidates=1, repair=1
+    )
+    cache = open_cache(args)
+    cache.put("tôi có nhà", "(c / có)")
+    cache.close()
+    for name, value in [("backend", "hf-cpu-int8"), ("validate_prefix", 1), ("num_candidates", 4), ("repair", 0)]:
+        cache = open_cache(SimpleNamespace(**{**vars(args), name: value}))
+        assert cache.get("tôi có nhà") is None, name
+        cache.close()
+    cache = open_cache(args)
+    assert cache.get("tôi có nhà") == "(c / có)"
+    cache.close()
+
+
+def test_sanitize_only_refuses_to_overwrite_its_input(tmp_path):
+    results = tmp_path / "results.txt"
+    results.write_text("#::snt 0 câu\n(a / b)\n\n", encoding="utf-8")
+    args = SimpleNamespace(sanitize_only=1, resume=0, input_file=str(results), output_file=str(tmp_path / "." / "results.txt"))
+    main(args)
+    assert results.read_text(encoding="utf-8") == "#::snt 0 câu\n(a / b)\n\n"
+
+    args.output_file = str(tmp_path / "sanitized.txt")
+    args.profile_imports = 0
+    main(args)
+    with open(args.output_file, "rb") as f:
+        assert [record[0] for record in iter_records(f.read())] == [0]
+
+
+def write_records(output_file, records):
+    with open(output_file, "ab") as out_f, open(manifest_path(output_file), "a", encoding="utf-8") as manifest_f:
+        for idx, amr_str in records:
+            commit_record(out_f, manifest_f, idx, f"câu {idx}", amr_str)
+
+
+def read_records(output_file):
+    with open(output_file, "rb") as f:
+        return [record[:3] for record in iter_records(f.read())]
+
+
+def test_sort_and_rebuild_keep_records_with_an_empty_amr(tmp_path):
+    output_file = str(tmp_path / "out.txt")
+    write_records(output_file, [(2, "(c / c)"), (1, "(b / b)"), (0, ""), (3, "(d / d)")])
+    sort_output(output_file)
+    expected = [(0, "câu 0", ""), (1, "câu 1", "(b / b)"), (2, "câu 2", "(c / c)"), (3, "câu 3", "(d / d)")]
+    assert read_records(output_file) == expected
+    assert load_progress(output_file) == {0, 1, 2, 3}
+
+    # Without a manifest it is rebuilt from every record
+    os.remove(manifest_path(output_file))
+    assert load_progress(output_file) == {0, 1, 2, 3}
+    assert read_records(output_file) == expected
+
+
+def test_sort_refuses_a_file_that_does_not_match_its_manifest(tmp_path):
+    output_file = str(tmp_path / "out.txt")
+    write_records(output_file, [(1, "(b / b)"), (0, "(a / a)")])
+    with open(manifest_path(output_file), "a", encoding="utf-8") as f:
+        f.write(json.dumps({"idx": 2, "offset": 10 ** 6}) + "\n")
+    with open(output_file, "rb") as f:
+        before = f.read()
+    sort_output(output_file)
+    with open(output_file, "rb") as f:
+        assert f.read() == before
+
+
+def test_resuming_a_finished_sharded_job_starts_no_workers(tmp_path, monkeypatch):
+    input_file = tmp_path / "input.txt"
+    input_file.write_text("câu 0\ncâu 1\n", encoding="utf-8")
+    output_file = str(tmp_path / "out.txt")
+    write_records(output_file, [(0, "(a / a)"), (1, "(b / b)")])
+
+    def fail(*args, **kwargs):
+        raise AssertionError("no model should be loaded")
+
+    monkeypatch.setattr("src.main.load_model", fail)
+    monkeypatch.setattr("src.main.run_shard", fail)
+    args = SimpleNamespace(sanitize_only=0, resume=1, my_test=0, input_file=str(input_file), output_file=output_file,
+                           num_workers=2, devices="cpu", profile_imports=0)
+    main(args)
+    assert [record[0] for record in read_records(output_file)] == [0, 1]
@@ -0,0 +1,41 @@
+from src import reward, smatch_fast
+
+
+def test_only_gold_graphs_enter_the_parse_cache():
+    gold = "(c / có :ARG0 (t / tôi) :ARG1 (n / nhà))"
+    pred = "(c / có :ARG0 (t / tôi) :ARG1 (n / nhà :mod (đ / đẹp)))"
+    smatch_fast.parse_amr.cache_clear()
+    reward.configure_smatch_engine("fast")
+    reward.configure_smatch_cache(0)
+    try:
+        f1, precision, recall = reward.compute_smatch_f1(gold, pred)
+        assert smatch_fast.parse_amr.cache_info().currsize == 1
+        reward.compute_smatch_f1(gold, "(c / có :ARG0 (t / tôi))")
+        info = smatch_fast.parse_amr.cache_info()
+        assert (info.currsize, info.hits) == (1, 1)
+    finally:
+        reward.configure_smatch_engine()
+        reward.configure_smatch_cache()
+    # The prediction has two extra triples, so it loses precision, not recall
+    assert recall == 1.0
+    assert precision < 1.0
+
+
+def test_precomputed_gold_graphs_are_built_once_per_hash():
+    from src.data_loader import gold_structures
+
+    gold = "(c / có :ARG0 (t / tôi) :ARG1 (n / nhà))"
+    structures = gold_structures(gold)
+    reward.configure_smatch_engine("fast")
+    reward.configure_smatch_cache(0)
+    try:
+        scores = [reward.compute_smatch_f1(gold, pred, *structures)
+                  for pred in (gold, "(c / có :ARG0 (t / tôi))")]
+        # Already built from the precomputed triples, so nothing is needed to rebuild it
+        graph = smatch_fast.gold_graph(structures[2], None, None)
+    finally:
+        reward.configure_smatch_engine()
+        reward.configure_smatch_cache()
+    assert scores[0] == (1.0, 1.0, 1.0)
+    assert scores[1][1] == 1.0
+    assert graph.num_triples == len(structures[1])
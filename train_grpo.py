@@ -7,12 +7,18 @@ import argparse
 import wandb
 
 from .data_loader import get_data
-from .reward import combined_reward
+from .reward import combined_reward, configure_reward_pool, configure_smatch_cache, configure_smatch_engine
 
 def main(args):
     wandb.init(project=args.wandb_project, name=args.wandb_run_name)
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    train_dataset = get_data(args.dataset1_path, args.dataset2_path, type="grpo")
+    configure_smatch_engine(args.smatch_engine, restarts=args.smatch_restarts)
+    configure_smatch_cache(args.smatch_cache_size, args.smatch_cache_path)
+    configure_reward_pool(args.reward_workers, timeout=args.reward_timeout)
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
+    tokenizer.pad_token = tokenizer.eos_token
+    train_dataset = get_data(args.dataset1_path, args.dataset2_path, type="grpo", num_proc=args.num_proc,
+                             cache_dir=args.dataset_cache_dir, tokenizer=tokenizer)
 
     training_args = GRPOConfig(
         output_dir=args.output_dir,
@@ -44,9 +50,6 @@ def main(args):
     )
     model.to(device)
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name)
-    tokenizer.pad_token = tokenizer.eos_token
-
     if args.use_lora:
         peft_config = LoraConfig(
             r=args.lora_r,
@@ -85,6 +88,8 @@ def parse_args():
     parser.add_argument("--dataset2_path", type=str, default=None, help="Path to the second dataset")
     parser.add_argument("--output_dir", type=str, default="./output", help="Directory to save the model")
     parser.add_argument("--deepspeed_path", type=str, default="./deepspeed_config.json", help="Path to the deepspeed config file")
+    parser.add_argument("--num_proc", type=int, default=1, help="Processes used to parse the AMR corpus")
+    parser.add_argument("--dataset_cache_dir", type=str, default=None, help="Cache the preprocessed dataset here, keyed by corpus content and prompts")
     parser.add_argument("--model_name", type=str, default="Qwen/Qwen2.5-7B-Instruct", help="Pretrained model name")
     parser.add_argument("--learning_rate", type=float, default=1e-5, help="Learning rate for training")
     parser.add_argument("--adam_beta1", type=float, default=0.9, help="Beta1 for Adam optimizer")
@@ -105,6 +110,12 @@ def parse_args():
     parser.add_argument("--lora_alpha", type=int, default=64, help="LoRA alpha value")
     parser.add_argument("--lora_dropout", type=float, default=0.1, help="LoRA dropout rate")
     parser.add_argument("--use_lora", type=int, default=0, help="Whether to use LoRA for training")
+    parser.add_argument("--reward_workers", type=int, default=0, help="Processes scoring completions in parallel (0 = inline)")
+    parser.add_argument("--reward_timeout", type=float, default=10.0, help="Seconds before a single completion's reward is abandoned (scored 0)")
+    parser.add_argument("--smatch_cache_size", type=int, default=100000, help="Smatch results kept in memory per process (0 disables the cache)")
+    parser.add_argument("--smatch_cache_path", type=str, default=None, help="SQLite file persisting smatch results across runs")
+    parser.add_argument("--smatch_engine", type=str, default="fast", choices=["reference", "fast"], help='"reference" (smatch package) or "fast" (smatch_fast, seeded NumPy hill-climbing)')
+    parser.add_argument("--smatch_restarts", type=int, default=4, help="Random restarts of the fast engine")
     parser.add_argument("--wandb_project", type=str, default="amr-training", help="WandB project name")
     parser.add_argument("--wandb_run_name", type=str, default="grpo-run", help="WandB run name")
     return parser.parse_args()
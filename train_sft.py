@@ -10,24 +10,60 @@ from .data_loader import get_data
 from .reward import compute_smatch_f1
 
 
+def length_grouping_kwargs():
+    """Length-grouped sampling; newer transformers replaced `group_by_length` with `train_sampling_strategy`."""
+    if "train_sampling_strategy" in SFTConfig.__dataclass_fields__:
+        return {"train_sampling_strategy": "group_by_length"}
+    return {"group_by_length": True}
+
+
+def report_fill(dataset, max_length, batch_size, packing):
+    """
+    Print how much of each training step is real tokens rather than padding.
+    Packed rows are filled up to `max_length`; unpacked batches are padded to
+    their longest example (length-grouped batches estimated by sorting).
+    """
+    if packing:
+        if "seq_lengths" in dataset.column_names:
+            tokens = sum(sum(lengths) for lengths in dataset["seq_lengths"])
+        else:
+            tokens = sum(len(ids) for ids in dataset["input_ids"])
+        capacity = len(dataset) * max_length
+        print(f"Packing: {tokens} tokens in {len(dataset)} sequences of {max_length}, efficiency {tokens / capacity:.1%}")
+        return
+    lengths = [min(len(ids), max_length) for ids in dataset["input_ids"]]
+
+    def efficiency(lengths):
+        batches = [lengths[i:i + batch_size] for i in range(0, len(lengths), batch_size)]
+        return sum(lengths) / sum(max(batch) * len(batch) for batch in batches)
+
+    print(f"Batches of {batch_size}: efficiency {efficiency(sorted(lengths)):.1%} length-grouped, "
+          f"{efficiency(lengths):.1%} in dataset order")
+
+
 def main(args):
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
+    tokenizer = AutoTokenizer.from_pretrained(args.model_name, trust_remote_code=True)
+    tokenizer.pad_token = tokenizer.eos_token
+
     # Load dataset
-    train_dataset = get_data(args.dataset1_path, args.dataset2_path, type="sft")
+    train_dataset = get_data(args.dataset1_path, args.dataset2_path, type="sft", num_proc=args.num_proc,
+                             cache_dir=args.dataset_cache_dir, tokenizer=tokenizer)
     # split_dataset = dataset.train_test_split(test_size=0.1, seed=42)
     # train_dataset = split_dataset["train"]
     # eval_dataset = split_dataset["test"]
 
-    tokenizer = AutoTokenizer.from_pretrained(args.model_name, trust_remote_code=True)
-    tokenizer.pad_token = tokenizer.eos_token
-
+    # Packed sequences only stay separated with an attention kernel that reads position_ids
+    attn_implementation = args.attn_implementation or ("flash_attention_2" if args.packing else None)
     model = AutoModelForCausalLM.from_pretrained(
         args.model_name,
         torch_dtype=torch.bfloat16 if torch.cuda.is_bf16_supported() else torch.float16,
-        trust_remote_code=True
+        trust_remote_code=True,
+        attn_implementation=attn_implementation
     ).to(device)
 
+    peft_config = None
     if args.use_lora:
         peft_config = LoraConfig(
             r=args.lora_r,
@@ -66,6 +102,9 @@ def main(args):
         completion_only_loss=False,
         deepspeed=args.deepspeed_path,
         max_length=args.max_input_length,
+        packing=bool(args.packing),
+        packing_strategy="bfd",
+        **(length_grouping_kwargs() if args.group_by_length and not args.packing else {}),
         # eval_strategy="steps",
         # eval_steps=args.eval_steps
     )
@@ -80,6 +119,7 @@ def main(args):
         peft_config=peft_config
     )
 
+    report_fill(trainer.train_dataset, args.max_input_length, args.per_device_train_batch_size, args.packing)
     trainer.train()
     trainer.save_model(args.output_dir)
     tokenizer.save_pretrained(args.output_dir)
@@ -90,6 +130,8 @@ def parse_args():
     parser.add_argument("--dataset1_path", type=str, required=True)
     parser.add_argument("--dataset2_path", type=str, default=None, help="Optional second dataset path for concatenation")
     parser.add_argument("--output_dir", type=str, default="./sft_lora_output")
+    parser.add_argument("--num_proc", type=int, default=1, help="Processes used to parse the AMR corpus")
+    parser.add_argument("--dataset_cache_dir", type=str, default=None, help="Cache the preprocessed dataset here, keyed by corpus content and prompts")
     parser.add_argument("--model_name", type=str, default="Qwen/Qwen2.5-7B-Instruct")
 
     # Training parameters
@@ -107,6 +149,9 @@ def parse_args():
     parser.add_argument("--lr_scheduler_type", type=str, default="linear")
     parser.add_argument("--max_input_length", type=int, default=1024)
     parser.add_argument("--eval_steps", type=int, default=500)
+    parser.add_argument("--packing", type=int, default=0, help="Pack several examples into each max_input_length sequence (best-fit decreasing)")
+    parser.add_argument("--group_by_length", type=int, default=0, help="Batch examples of similar length together (unpacked only)")
+    parser.add_argument("--attn_implementation", type=str, default=None, help="Attention kernel; defaults to flash_attention_2 with --packing")
 
     # LoRA parameters
     parser.add_argument("--use_lora", type=int, default=0, help="Use LoRA for training")